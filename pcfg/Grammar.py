@@ -1,42 +1,39 @@
 # %%
-from random import sample
-from math import log
+import os
+import sys
 
+import numpy as np
 import pandas as pd
+
+try:
+  PCFG_DIR = os.path.dirname(os.path.abspath(__file__))
+except NameError:
+  # Run cell by cell in an interactive window, from the pcfg directory
+  PCFG_DIR = os.getcwd()
+sys.path.append(os.path.join(PCFG_DIR, '..', 'planning'))
+from rllib.grammar import CompiledGrammar
 # %%
 class Rational_rules:
-  def __init__(self, p_rules, cap=10):
+  def __init__(self, p_rules, cap=10, seed=None):
+    # seed: int or np.random.Generator, for reproducible sampling
     self.NON_TERMINALS = [x[0] for x in p_rules]
     self.PRODUCTIONS = {}
     self.CAP = cap
     for rule in p_rules:
       self.PRODUCTIONS[rule[0]] = rule[1]
+    self.grammar = CompiledGrammar(p_rules, cap)
+    self.rng = np.random.default_rng(seed)
+
+  def generate_tree(self, logging=True, tree_str='S', log_prob=0., depth=0, rng=None):
+    rng = self.rng if rng is None else rng
+    result = self.grammar.sample(1, rng, tree_str, log_prob, depth)[0]
+    if logging:
+      print('====DEPTH EXCEEDED!====' if result is None else ' '.join(map(str, result)))
+    return result
 
-  def generate_tree(self, logging=True, tree_str='S', log_prob=0., depth=0):
-    current_nt_indices = [tree_str.find(nt) for nt in self.NON_TERMINALS]
-    # Sample a non-terminal for generation
-    to_gen_idx = sample([idx for idx, el in enumerate(current_nt_indices) if el > -1], 1)[0]
-    to_gen_nt = self.NON_TERMINALS[to_gen_idx]
-    # Do generation
-    leaf = sample(self.PRODUCTIONS[to_gen_nt], 1)[0]
-    to_gen_tree_idx = tree_str.find(to_gen_nt)
-    tree_str = tree_str[:to_gen_tree_idx] + leaf + tree_str[(to_gen_tree_idx+1):]
-    # Update production log prob
-    log_prob += log(1/len(self.PRODUCTIONS[to_gen_nt]))
-    # Increase depth count
-    depth += 1
-
-    # Recursively rewrite string
-    if any (nt in tree_str for nt in self.NON_TERMINALS) and depth <= self.CAP:
-      return self.generate_tree(logging, tree_str, log_prob, depth)
-    elif any (nt in tree_str for nt in self.NON_TERMINALS):
-      if logging:
-        print('====DEPTH EXCEEDED!====')
-      return None
-    else:
-      if logging:
-        print(tree_str, log_prob)
-      return tree_str, log_prob
+  def generate_trees(self, n, rng=None):
+    # Failed draws are None, as in generate_tree
+    return self.grammar.sample(n, self.rng if rng is None else rng)
 
 
 # %%
@@ -70,11 +67,7 @@ test = Rational_rules(productions, cap=100)
 
 # %% Collect some sample rules
 num_iterations = 100000
-outputs = []
-for _ in range(num_iterations):
-    x = test.generate_tree(logging=False)
-    if x is not None:
-      outputs.append(x)
+outputs = [x for x in test.generate_trees(num_iterations) if x is not None]
 
 
 df = pd.DataFrame(outputs, columns=['program', 'lp'])
@@ -88,4 +81,12 @@ result_df = result_df.sort_values(by='count', ascending=False).reset_index()
 
 result_df[['program', 'lp', 'count']].to_csv('programs_2.csv', index=False)
 
+# %% Exact probabilities of the most likely programs. Most of the mass of
+# this grammar lies in many improbable programs, so check pruned_mass
+distribution = test.grammar.enumerate_programs(min_prob=1e-6)
+print(f"Mass lost to the depth cap: {distribution.cap_mass:.4f}, below min_prob: {distribution.pruned_mass:.4f}")
+
+exact_df = pd.DataFrame(distribution.programs, columns=['program', 'prob', 'lp'])
+exact_df[['program', 'lp', 'prob']].to_csv('programs_exact.csv', index=False)
+
 # %%
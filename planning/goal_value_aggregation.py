@@ -2,10 +2,12 @@ import os
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
-from rllib.shapeworld import State, Shape
+from rllib.shapeworld import ShapeWorld, State, Shape
+from rllib.store import ValueStore
 from pathlib import Path
 import logging
 from typing import Dict, Tuple
+from multiprocessing import Pool
 
 # Set up logging
 logging.basicConfig(
@@ -19,15 +21,116 @@ logger = logging.getLogger(__name__)
 # Shape = namedtuple('Shape',['sides', 'shade', 'texture'])
 # State = namedtuple('State',['shape1', 'shape2', 'shape3'])
 
-def load_value_functions(directory: str) -> Dict[State, Dict[State, float]]:
-    """Load all value function files from the specified directory.
+def load_value_store(path: str) -> ValueStore:
+    """Open a goal x state value store (see plan_all_goals.py) read-only.
     
     Args:
-        directory: Path to directory containing value function files
+        path: Path to the store directory
         
     Returns:
-        Dictionary mapping goal states to their value functions
+        ValueStore whose values are memory-mapped rather than loaded
         
+    Raises:
+        FileNotFoundError: If no store exists at path
+        ValueError: If no goals have been completed in the store
+    """
+    logger.info(f'Opening value store: {path}')
+    store = ValueStore(path, mode='r')
+    n_completed = int(store.completed.sum())
+    if not n_completed:
+        raise ValueError(f"No completed goals in value store {path}")
+    logger.info(f"Found {n_completed} completed goals; metadata: {store.metadata}")
+    return store
+
+# Quantiles of each goal's value function reported alongside mean/std/min/max
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+STATISTICS = ('mean', 'std', 'min', 'max') + tuple(f'q{int(q * 100):02d}' for q in QUANTILES)
+
+def summarize_values(values: np.ndarray) -> np.ndarray:
+    """Compute summary statistics of each row of a (n_goals x n_states) array.
+    
+    Args:
+        values: One value function per row
+        
+    Returns:
+        Array of shape (n_goals, len(STATISTICS))
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.column_stack([
+        values.mean(axis=1),
+        values.std(axis=1),
+        values.min(axis=1),
+        values.max(axis=1),
+        *np.quantile(values, QUANTILES, axis=1),
+    ])
+
+def _summarize_store_chunk(task: Tuple[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Summarize one chunk of goal rows, opening the store in this process."""
+    path, goals = task
+    store = ValueStore(path, mode='r')
+    return goals, summarize_values(store.values[goals])
+
+def _summarize_pickle_chunk(files: list) -> Tuple[list, np.ndarray]:
+    """Summarize one chunk of per-goal pickle files."""
+    goal_states, rows = [], []
+    for filepath in files:
+        try:
+            value_function, goal_state = pd.read_pickle(filepath)
+        except Exception as e:
+            logger.error(f"Error loading {filepath}: {str(e)}")
+            continue
+        goal_states.append(goal_state)
+        rows.append(np.fromiter(value_function.values(), dtype=np.float64, count=len(value_function)))
+    if not rows:
+        return goal_states, np.empty((0, len(STATISTICS)))
+    return goal_states, summarize_values(np.stack(rows))
+
+def _map_chunks(function, tasks: list, workers: int, desc: str):
+    """Yield function(task) for every task, across `workers` processes."""
+    if workers <= 1:
+        yield from tqdm(map(function, tasks), total=len(tasks), desc=desc)
+        return
+    with Pool(workers) as pool:
+        yield from tqdm(pool.imap(function, tasks), total=len(tasks), desc=desc)
+
+def calculate_goal_value_statistics(
+    store_path: str, chunk_size: int = 256, workers: int = 1
+) -> Dict[State, Dict[str, float]]:
+    """Stream summary statistics of every completed goal in a value store.
+    
+    Goal rows are read from the memory-mapped store one chunk at a time and
+    summarized in a single pass, so peak memory is one chunk per worker no
+    matter how many goals or states there are.
+    
+    Args:
+        store_path: Path to the store directory
+        chunk_size: Number of goals summarized together
+        workers: Number of worker processes
+        
+    Returns:
+        Dictionary mapping goal states to their statistics (see STATISTICS)
+    """
+    store = load_value_store(store_path)
+    _, state_space = ShapeWorld.build_spaces()
+    goals = np.flatnonzero(store.completed)
+    tasks = [(store_path, goals[i:i + chunk_size]) for i in range(0, len(goals), chunk_size)]
+    
+    logger.info("Calculating goal value statistics from store...")
+    statistics = {}
+    for chunk_goals, chunk_stats in _map_chunks(_summarize_store_chunk, tasks, workers, 'Summarizing chunks'):
+        for goal, stats in zip(chunk_goals, chunk_stats):
+            statistics[state_space[goal]] = dict(zip(STATISTICS, stats.tolist()))
+    logger.info(f"Calculated statistics for {len(statistics)} goals")
+    return statistics
+
+def calculate_goal_value_statistics_from_pickles(
+    directory: str, chunk_size: int = 256, workers: int = 1
+) -> Dict[State, Dict[str, float]]:
+    """Stream summary statistics of per-goal pickles written by value_iteration.py.
+    
+    Like `calculate_goal_value_statistics`, only one chunk of value
+    functions per worker is held in memory at a time.
+    
     Raises:
         FileNotFoundError: If directory doesn't exist
         ValueError: If no .pkl files found in directory
@@ -35,47 +138,34 @@ def load_value_functions(directory: str) -> Dict[State, Dict[State, float]]:
     directory_path = Path(directory)
     if not directory_path.exists():
         raise FileNotFoundError(f"Directory not found: {directory}")
-    
-    logger.info(f'Loading value functions from directory: {directory}')
-    value_functions = {}
-    pkl_files = list(directory_path.glob('*.pkl'))
-    
+    pkl_files = sorted(directory_path.glob('*.pkl'))
     if not pkl_files:
         raise ValueError(f"No .pkl files found in {directory}")
+    tasks = [pkl_files[i:i + chunk_size] for i in range(0, len(pkl_files), chunk_size)]
     
-    for filepath in tqdm(pkl_files, desc='Loading files'):
-        try:
-            value_function, goal_state = pd.read_pickle(filepath)
-            value_functions[goal_state] = value_function
-        except Exception as e:
-            logger.error(f"Error loading {filepath}: {str(e)}")
-            continue
-            
-    logger.info(f"Loaded {len(value_functions)} value functions")
-    return value_functions
+    logger.info(f"Calculating goal value statistics from {len(pkl_files)} files...")
+    statistics = {}
+    for goal_states, chunk_stats in _map_chunks(_summarize_pickle_chunk, tasks, workers, 'Summarizing chunks'):
+        for goal_state, stats in zip(goal_states, chunk_stats):
+            statistics[goal_state] = dict(zip(STATISTICS, stats.tolist()))
+    logger.info(f"Calculated statistics for {len(statistics)} goals")
+    return statistics
 
-def calculate_goal_value_functions(
-    value_functions: Dict[State, Dict[State, float]]
+def calculate_goal_values_from_store(
+    store: ValueStore, chunk_size: int = 256, workers: int = 1
 ) -> Dict[State, float]:
-    """Calculate the average value for each goal state across all state values.
+    """Calculate the average value for each completed goal in a value store.
     
     Args:
-        value_functions: Dictionary mapping goal states to their value functions
+        store: Value store with one row per goal ID
+        chunk_size: Number of goals summarized together
+        workers: Number of worker processes
         
     Returns:
         Dictionary mapping goal states to their average values
     """
-    logger.info("Calculating goal value functions...")
-    goal_value_function = {}
-    
-    for goal_state, value_function in tqdm(value_functions.items(), desc='Calculating values'):
-        # Convert values to numpy array for faster computation
-        values = np.array(list(value_function.values()))
-        average_value = np.mean(values)
-        goal_value_function[goal_state] = average_value
-        
-    logger.info(f"Calculated values for {len(goal_value_function)} goals")
-    return goal_value_function
+    statistics = calculate_goal_value_statistics(store.path, chunk_size, workers)
+    return {goal: stats['mean'] for goal, stats in statistics.items()}
 
 def state_to_dict(state: State) -> dict:
     """Convert a State object to a dictionary for CSV output.
@@ -98,12 +188,14 @@ def state_to_dict(state: State) -> dict:
         'shape3_texture': state.shape3.texture
     }
 
-def save_as_csv(goal_value_function: Dict[State, float], output_file: str) -> None:
+def save_as_csv(goal_value_function: Dict[State, float], output_file: str,
+                statistics: Dict[State, Dict[str, float]] = None) -> None:
     """Save the goal value function as a CSV file.
     
     Args:
         goal_value_function: Dictionary mapping states to values
         output_file: Path to save CSV file
+        statistics: Optional per-goal statistics saved as extra columns
         
     Raises:
         IOError: If unable to write to output file
@@ -112,7 +204,8 @@ def save_as_csv(goal_value_function: Dict[State, float], output_file: str) -> No
     try:
         # Convert to DataFrame in one go for better performance
         rows = [
-            {**state_to_dict(state), 'value': value}
+            {**state_to_dict(state), 'value': value,
+             **{f'value_{k}': v for k, v in (statistics or {}).get(state, {}).items() if k != 'mean'}}
             for state, value in goal_value_function.items()
         ]
         df = pd.DataFrame(rows)
@@ -142,12 +235,19 @@ def main():
         output_dir = Path('./results')
         output_dir.mkdir(exist_ok=True)
         
-        # Load value functions
-        directory = './value-iteration-results'
-        value_functions = load_value_functions(directory)
-
-        # Calculate the goal value function
-        goal_value_function = calculate_goal_value_functions(value_functions)
+        # Prefer the memory-mapped value store written by plan_all_goals.py,
+        # falling back to per-goal pickles from value_iteration.py. Either
+        # way the goal results are streamed a chunk at a time.
+        store_path = './value-iteration-store'
+        workers = os.cpu_count()
+        if Path(store_path).exists():
+            statistics = calculate_goal_value_statistics(store_path, workers=workers)
+        else:
+            directory = './value-iteration-results'
+            statistics = calculate_goal_value_statistics_from_pickles(directory, workers=workers)
+        
+        # The goal value function is the mean value over all states
+        goal_value_function = {goal: stats['mean'] for goal, stats in statistics.items()}
 
         # Save as pickle file
         pkl_output = output_dir / 'goal_value_function.pkl'
@@ -156,7 +256,7 @@ def main():
 
         # Save as CSV file
         csv_output = output_dir / 'goal_value_function.csv'
-        save_as_csv(goal_value_function, csv_output)
+        save_as_csv(goal_value_function, csv_output, statistics)
         
     except Exception as e:
         logger.error(f"Error in main execution: {str(e)}")
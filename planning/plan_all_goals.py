@@ -0,0 +1,161 @@
+'''
+Summary: 
+* Local batch driver for planning over many goals on a single many-core box.
+* Runs goal ranges across a process pool, one worker per core by default.
+* Writes every goal's value function as one row of a memory-mapped
+  goal x state value store, which records which goals are completed.
+* Skips goals already completed in the store, so an interrupted run resumes.
+
+Usage: python plan_all_goals.py [--start 0] [--stop 19683] [--workers N]
+'''
+
+##################################################
+# IMPORTS
+##################################################
+
+# Core imports
+import argparse
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+from tqdm import tqdm
+
+# Custom imports
+from rllib.shapeworld import ShapeWorld, State, Shape
+from rllib.batch import BatchValueIteration
+from rllib.store import ValueStore
+
+##################################################
+# WORKERS
+##################################################
+
+# Per-process solver and output store. Built before the pool forks so every
+# worker shares the read-only transition kernel with the parent instead of
+# rebuilding it, and writes its rows into the same memory-mapped store.
+_solver: BatchValueIteration = None
+_store: ValueStore = None
+
+def make_world(discount_rate: float) -> ShapeWorld:
+    """Return a ShapeWorld used only for its (goal-independent) dynamics."""
+    initial_state = State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    )
+    return ShapeWorld(initial_state, discount_rate)
+
+def solver_metadata(env: ShapeWorld, threshold: float, max_iterations: int) -> dict:
+    """Describe everything the stored value functions depend on."""
+    shape_prob, texture_prob, shade_prob = env.transition_params()
+    return {
+        'discount_rate': env.discount_rate,
+        'threshold': threshold,
+        'max_iterations': max_iterations,
+        'shape_transition_prob': shape_prob,
+        'texture_transition_prob': texture_prob,
+        'shade_cycle_prob': shade_prob,
+        'step_cost': env.STEP_COST,
+        'goal_reward': env.GOAL_REWARD,
+    }
+
+def init_solver(env: ShapeWorld, chunk_size: int, threshold: float,
+                max_iterations: int, store: ValueStore) -> None:
+    """Set up the shared batch solver and output store for this process."""
+    global _solver, _store
+    env.transition_matrices()
+    _solver = BatchValueIteration(
+        mdp=env,
+        chunk_size=chunk_size,
+        threshold=threshold,
+        verbose=False,
+        max_iterations=max_iterations,
+        use_symmetry=True
+    )
+    _store = store
+
+def solve_shard(goals: list[int]) -> int:
+    """Solve a shard of goals and write their rows; return the number solved."""
+    _store.write(goals, _solver.solve(goals))
+    return len(goals)
+
+##################################################
+# SHARDING
+##################################################
+
+def make_shards(goals: np.ndarray, shard_size: int) -> list[list[int]]:
+    """Group goals into shards of about `shard_size` slot-permutation orbits.
+
+    Goals in the same orbit always land in the same shard, so each orbit is
+    solved once and its other members are filled in by permutation.
+    """
+    representatives, _ = ShapeWorld.canonical_states(goals)
+    unique_reps, rep_index = np.unique(representatives, return_inverse=True)
+    shards = []
+    for start in range(0, len(unique_reps), shard_size):
+        in_shard = (rep_index >= start) & (rep_index < start + shard_size)
+        shards.append(goals[in_shard].tolist())
+    return shards
+
+##################################################
+# MAIN
+##################################################
+
+def main():
+    """Main execution function."""
+    n_states = ShapeWorld.num_shapes() ** 3
+    parser = argparse.ArgumentParser(description='Plan over a range of goals in parallel.')
+    parser.add_argument('--start', type=int, default=0, help='First goal index')
+    parser.add_argument('--stop', type=int, default=n_states, help='One past the last goal index')
+    parser.add_argument('--discount-rate', type=float, default=0.95)
+    parser.add_argument('--threshold', type=float, default=1e-6)
+    parser.add_argument('--max-iterations', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--shard-size', type=int, default=32, help='Goal orbits per task')
+    parser.add_argument('--chunk-size', type=int, default=32, help='Goals iterated together')
+    parser.add_argument('--store', default='./value-iteration-store', help='Value store directory')
+    parser.add_argument('--dtype', default='float64', choices=['float32', 'float64'])
+    args = parser.parse_args()
+
+    if not 0 <= args.start < args.stop <= n_states:
+        parser.error(f"Goal range must lie within [0, {n_states})")
+    env = make_world(args.discount_rate)
+    store = ValueStore.open_or_create(
+        args.store, n_goals=n_states, n_states=n_states,
+        metadata=solver_metadata(env, args.threshold, args.max_iterations),
+        dtype=args.dtype
+    )
+
+    # Resume: only goals not yet completed in the store are solved
+    goals = store.pending(range(args.start, args.stop))
+    n_done = (args.stop - args.start) - len(goals)
+    if n_done:
+        print(f"Resuming: {n_done} goals already solved, {len(goals)} remaining")
+    if len(goals) == 0:
+        return
+    shards = make_shards(goals, args.shard_size)
+
+    init_solver(env, args.chunk_size, args.threshold, args.max_iterations, store)
+    start_time = time.time()
+    pbar = tqdm(total=len(goals), desc='Goals')
+
+    def report(n_solved):
+        pbar.update(n_solved)
+        pbar.set_postfix({'goals/sec': f'{pbar.n / (time.time() - start_time):.2f}'})
+
+    if args.workers <= 1:
+        for shard in shards:
+            report(solve_shard(shard))
+    else:
+        # Fork so workers inherit the solver built above
+        context = mp.get_context('fork')
+        with context.Pool(args.workers) as pool:
+            for n_solved in pool.imap_unordered(solve_shard, shards):
+                report(n_solved)
+    pbar.close()
+
+    elapsed = time.time() - start_time
+    print(f"Solved {len(goals)} goals in {elapsed:.1f}s ({len(goals) / elapsed:.2f} goals/sec)")
+
+if __name__ == "__main__":
+    main()
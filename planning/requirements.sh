@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # List of required Python packages
-required_packages=("numpy" "pandas" "matplotlib" "random" "gymnasium" "typing" "collections" "tqdm" "itertools" "collections")
+required_packages=("numpy" "scipy" "pandas" "matplotlib" "random" "gymnasium" "typing" "collections" "tqdm" "itertools" "collections")
 
 # Check if each package is installed
 for package in "${required_packages[@]}"; do
@@ -11,4 +11,10 @@ for package in "${required_packages[@]}"; do
     else
         echo "$package is already installed."
     fi
-done
\ No newline at end of file
+done
+
+# Policy evaluation passes rtol= to scipy's iterative solvers, added in scipy 1.12
+if ! python -c "import scipy; import sys; sys.exit(tuple(map(int, scipy.__version__.split('.')[:2])) < (1, 12))" &> /dev/null; then
+    echo "Upgrading scipy to >= 1.12..."
+    conda install "scipy>=1.12"
+fi
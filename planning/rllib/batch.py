@@ -0,0 +1,289 @@
+from typing import Sequence
+import numpy as np
+from scipy import sparse
+from tqdm import tqdm
+from .shapeworld import ShapeWorld
+
+class BatchValueIteration:
+    """Value iteration for many ShapeWorld goals at once.
+
+    Every goal shares the same transition kernel, so a block of goals is
+    solved together by iterating a (n_states x n_goals) value matrix: each
+    sweep is one sparse matrix-matrix product against the stacked per-action
+    kernels. Goals that have converged drop out of the active block.
+
+    The dynamics are invariant under permuting the three slots, so the value
+    function of a permuted goal is the same permutation of an already solved
+    one. With `use_symmetry`, only one goal per orbit is iterated and the
+    others are filled in by indexing.
+
+    With `warm_start`, each goal starts from the value function of the
+    already solved goal nearest to it in (weighted) feature Hamming distance.
+    Goals that differ only in texture have the closest value functions, so
+    texture mismatches are weighted down and goals are ordered with their
+    textures most significant: after the first texture combination, every
+    goal has a texture-only neighbour solved before it. Value iteration
+    converges from any starting values, so this only changes how many sweeps
+    are needed, not the answer.
+
+    `solve_discounts` solves every goal under several discount rates in the
+    same pass: each column of the value matrix is a (discount, goal) pair
+    with its own discount, so one product with the shared kernel serves all
+    of them, and each pair converges and leaves the block on its own.
+
+    The results match running `ValueIteration` on `ShapeWorld(goal, ...)`
+    separately for each goal.
+    """
+
+    # Weights of (sides, shade, texture) mismatches in the warm-start distance
+    WARM_START_FEATURE_WEIGHTS = (1.0, 1.0, 0.25)
+
+    def __init__(self, mdp: ShapeWorld,
+                 chunk_size: int = 64,
+                 initial_value: float = 0.0,
+                 threshold: float = 1e-6,
+                 verbose: bool = True,
+                 max_iterations: int = 1000,
+                 use_symmetry: bool = True,
+                 warm_start: bool = False):
+        """Initialize the batch solver.
+
+        Args:
+            mdp: ShapeWorld providing the kernel, rewards and discount rate.
+                Its own GOAL is ignored.
+            chunk_size: Number of goals iterated together, which bounds memory
+            initial_value: Initial value of every state
+            threshold: Convergence threshold on the max value change
+            verbose: Whether to show a progress bar over goal chunks
+            max_iterations: Maximum number of sweeps per goal
+            use_symmetry: Whether to solve one representative goal per slot
+                permutation orbit and permute its values for the others
+            warm_start: Whether to seed each goal with the value function of
+                the nearest already solved goal instead of initial_value
+        """
+        if not isinstance(mdp, ShapeWorld):
+            raise TypeError("mdp must be an instance of ShapeWorld")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if threshold <= 0:
+            raise ValueError("threshold must be positive")
+        if max_iterations <= 0:
+            raise ValueError("max_iterations must be positive")
+        self.mdp = mdp
+        self.chunk_size = chunk_size
+        self.initial_value = initial_value
+        self.threshold = threshold
+        self.verbose = verbose
+        self.max_iterations = max_iterations
+        self.use_symmetry = use_symmetry
+        self.warm_start = warm_start
+
+        self.states = list(mdp.get_state_space())
+        self.n_states = len(self.states)
+        self.n_actions = len(mdp.action_space)
+        self.transitions = sparse.vstack(mdp.transition_matrices(), format='csr')
+
+        # Per-goal convergence info for the most recent call to `solve`
+        self.iterations = np.zeros(0, dtype=int)
+        self.deltas = np.zeros(0)
+
+    def solve(self, goals: Sequence[int], initial: np.ndarray = None) -> np.ndarray:
+        """Solve for the value function of every goal.
+
+        Args:
+            goals: Indices of the goal states in the state space
+            initial: Optional array of shape (len(goals), n_states) of
+                starting values, e.g. solutions of a nearby world. Overrides
+                initial_value and warm_start.
+
+        Returns:
+            np.ndarray: Array of shape (len(goals), n_states), one value
+            function per goal
+        """
+        goals = np.asarray(goals, dtype=int)
+        if initial is not None:
+            initial = np.asarray(initial, dtype=float)
+            if initial.shape != (len(goals), self.n_states):
+                raise ValueError(f"initial must have shape {(len(goals), self.n_states)}")
+        if self.use_symmetry:
+            return self._solve_orbits(goals, initial)
+        return self._solve_goals(goals, initial)
+
+    def solve_discounts(self, goals: Sequence[int], discount_rates: Sequence[float]) -> np.ndarray:
+        """Solve for the value function of every goal under every discount rate.
+
+        Args:
+            goals: Indices of the goal states in the state space
+            discount_rates: Discount rates, each in (0, 1)
+
+        Returns:
+            np.ndarray: Array of shape (len(discount_rates), len(goals),
+            n_states). `iterations` and `deltas` get shape
+            (len(discount_rates), len(goals)).
+        """
+        goals = np.asarray(goals, dtype=int)
+        discount_rates = np.asarray(discount_rates, dtype=float)
+        if not ((discount_rates > 0) & (discount_rates < 1)).all():
+            raise ValueError("discount rates must be in (0, 1)")
+        # One column per (discount, goal) pair, discount-major
+        column_goals = np.tile(goals, len(discount_rates))
+        column_discounts = np.repeat(discount_rates, len(goals))
+        if self.use_symmetry:
+            values = self._solve_orbits(column_goals, discounts=column_discounts)
+        else:
+            values = self._solve_goals(column_goals, discounts=column_discounts)
+        shape = (len(discount_rates), len(goals))
+        self.iterations = self.iterations.reshape(shape)
+        self.deltas = self.deltas.reshape(shape)
+        return values.reshape(shape + (self.n_states,))
+
+    def has_converged(self) -> np.ndarray:
+        """Check which goals of the most recent solve have converged."""
+        return (self.iterations > 0) & (self.deltas <= self.threshold)
+
+    def _solve_orbits(self, goals: np.ndarray, initial: np.ndarray = None,
+                      discounts: np.ndarray = None) -> np.ndarray:
+        """Solve one representative per orbit and permute values for the rest."""
+        representatives, perm_indices = self.mdp.canonical_states(goals)
+        if discounts is None:
+            discounts = np.full(len(goals), self.mdp.discount_rate)
+        # Goals only share a solution under the same discount
+        keys, rep_index = np.unique(
+            np.stack([discounts, representatives], axis=1), axis=0, return_inverse=True
+        )
+        rep_index = rep_index.ravel()
+        unique_reps, rep_discounts = keys[:, 1].astype(int), keys[:, 0]
+
+        # V_goal[permute(s)] = V_rep[s] when goal = permute(rep)
+        permuted_states = [
+            self.mdp.permute_slots(np.arange(self.n_states), perm)
+            for perm in self.mdp.SLOT_PERMUTATIONS
+        ]
+        rep_initial = None
+        if initial is not None:
+            # Start each representative from the first of its goals, mapped back
+            first = np.unique(rep_index, return_index=True)[1]
+            rep_initial = np.stack([
+                initial[i, permuted_states[perm_indices[i]]] for i in first
+            ])
+        rep_values = self._solve_goals(unique_reps, rep_initial, rep_discounts)
+
+        values = np.empty((len(goals), self.n_states))
+        for i in range(len(goals)):
+            values[i, permuted_states[perm_indices[i]]] = rep_values[rep_index[i]]
+        self.iterations = self.iterations[rep_index]
+        self.deltas = self.deltas[rep_index]
+        return values
+
+    def _solve_goals(self, goals: np.ndarray, initial: np.ndarray = None,
+                     discounts: np.ndarray = None) -> np.ndarray:
+        """Solve every goal, a chunk at a time."""
+        if discounts is None:
+            discounts = np.full(len(goals), self.mdp.discount_rate)
+        # Warm starts solve goals in a locality-preserving order so close
+        # neighbours are solved first; results are put back in the requested
+        # order at the end
+        order = self._warm_start_order(goals) if self.warm_start else np.arange(len(goals))
+        ordered_goals = goals[order]
+        ordered_discounts = discounts[order]
+        values = np.empty((len(goals), self.n_states))
+        iterations = np.zeros(len(goals), dtype=int)
+        deltas = np.full(len(goals), np.inf)
+
+        starts = range(0, len(goals), self.chunk_size)
+        for start in tqdm(starts, desc="Batch Value Iteration", disable=not self.verbose):
+            chunk = slice(start, start + self.chunk_size)
+            chunk_initial = None
+            if initial is not None:
+                chunk_initial = initial[order[chunk]].T
+            elif self.warm_start and start > 0:
+                chunk_initial = self._warm_start_values(
+                    ordered_goals[chunk], ordered_goals[:start], values[:start]
+                )
+            values[chunk] = self._solve_chunk(
+                ordered_goals[chunk], ordered_discounts[chunk],
+                iterations[chunk], deltas[chunk], chunk_initial
+            ).T
+
+        self.iterations = np.empty_like(iterations)
+        self.iterations[order] = iterations
+        self.deltas = np.empty_like(deltas)
+        self.deltas[order] = deltas
+        n_unconverged = int(np.sum(self.deltas > self.threshold))
+        if n_unconverged:
+            print(f"Warning: {n_unconverged} goals reached maximum iterations without converging")
+        solved = np.empty_like(values)
+        solved[order] = values
+        return solved
+
+    def _warm_start_order(self, goals: np.ndarray) -> np.ndarray:
+        """Return the order in which to solve goals, textures most significant."""
+        textures = self.mdp.decode_states(goals)[..., 2]
+        return np.lexsort((goals, textures[:, 2], textures[:, 1], textures[:, 0]))
+
+    def _warm_start_values(self, goals: np.ndarray, solved_goals: np.ndarray,
+                           solved_values: np.ndarray) -> np.ndarray:
+        """Return initial values taken from the nearest solved goal of each goal.
+
+        Nearness is the weighted number of differing features (Hamming
+        distance) between the encoded goal states.
+
+        Returns:
+            np.ndarray: Value matrix of shape (n_states, len(goals))
+        """
+        features = self.mdp.decode_states(goals)
+        solved_features = self.mdp.decode_states(solved_goals)
+        mismatches = features[:, None] != solved_features[None, :]
+        distances = (mismatches * np.array(self.WARM_START_FEATURE_WEIGHTS)).sum(axis=(-2, -1))
+        nearest = distances.argmin(axis=1)
+        return solved_values[nearest].T
+
+    def _solve_chunk(self, goals: np.ndarray, discounts: np.ndarray, iterations: np.ndarray,
+                     deltas: np.ndarray, initial: np.ndarray = None) -> np.ndarray:
+        """Iterate one block of goals, each with its own discount, to convergence.
+
+        `iterations` and `deltas` are views that are updated in place.
+        `initial` optionally gives the (n_states x n_goals) starting values.
+
+        Returns:
+            np.ndarray: Value matrix of shape (n_states, len(goals))
+        """
+        values = np.empty((self.n_states, len(goals)))
+        # Contiguous block holding only the goals that are still iterating
+        if initial is None:
+            block = np.full((self.n_states, len(goals)), self.initial_value, dtype=float)
+        else:
+            block = np.array(initial, dtype=float)
+        active = np.arange(len(goals))
+
+        while active.size:
+            new_block = self._backup(block, goals[active], discounts[active])
+            change = np.abs(new_block - block)
+            change[goals[active], np.arange(active.size)] = 0.0
+            block = new_block
+            iterations[active] += 1
+            deltas[active] = change.max(axis=0)
+
+            done = (deltas[active] <= self.threshold) | (iterations[active] >= self.max_iterations)
+            if done.any():
+                values[:, active[done]] = block[:, done]
+                block = block[:, ~done]
+                active = active[~done]
+
+        return values
+
+    def _backup(self, values: np.ndarray, goals: np.ndarray, discounts: np.ndarray) -> np.ndarray:
+        """Return the Bellman backup of a (n_states x n_goals) value matrix.
+
+        The reward of landing in the goal is folded into the propagated
+        values, so each backup needs a single sparse product:
+        Q[a] = STEP_COST + P[a] @ (discount * V + GOAL_REWARD * onehot(goal)),
+        with each column's own discount.
+        """
+        columns = np.arange(len(goals))
+        target = values * discounts
+        target[goals, columns] += self.mdp.GOAL_REWARD
+        q_values = (self.transitions @ target).reshape(self.n_actions, self.n_states, len(goals))
+        new_values = self.mdp.STEP_COST + q_values.max(axis=0)
+        new_values[goals, columns] = 0.0
+        return new_values
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+from .shapeworld import ShapeWorld
+
+class SolutionCache:
+    """Content-addressed cache of ShapeWorld value functions.
+
+    Each solution is stored under a hash of everything it depends on: the
+    goal, discount rate, transition parameters, reward constants and
+    convergence threshold. Changing any of them changes the key, so a stale
+    solution is never returned.
+
+    Lookups go through an in-memory LRU of `max_entries` arrays, backed by a
+    directory of `<key>.npy` files. The directory is trimmed to `max_bytes`
+    by deleting the least recently used files. Every hit, in memory or on
+    disk, refreshes the file's modification time, so eviction follows the
+    same recency as lookups and survives restarts.
+    """
+
+    def __init__(self, directory: str = './value-iteration-cache',
+                 max_entries: int = 64,
+                 max_bytes: int = 2 ** 30):
+        """Open (or create) a cache directory.
+
+        Args:
+            directory: Directory holding the cached value functions
+            max_entries: Number of value functions kept in memory
+            max_bytes: Maximum total size of the files in `directory`
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+
+    @staticmethod
+    def key(mdp: ShapeWorld, threshold: float) -> str:
+        """Return the cache key of the solution of `mdp` to `threshold`."""
+        shape_prob, texture_prob, shade_prob = mdp.transition_params()
+        description = {
+            'world': type(mdp).__name__,
+            'goal': mdp.state_id(mdp.GOAL),
+            'discount_rate': mdp.discount_rate,
+            'shape_transition_prob': shape_prob,
+            'texture_transition_prob': texture_prob,
+            'shade_cycle_prob': shade_prob,
+            'step_cost': mdp.STEP_COST,
+            'goal_reward': mdp.GOAL_REWARD,
+            'threshold': threshold,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key: str) -> np.ndarray:
+        """Return the cached values for `key`, or None on a miss."""
+        path = self._path(key)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            return self._memory[key]
+        try:
+            values = np.load(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since the load; the values are still valid
+            pass
+        self._remember(key, values)
+        return values
+
+    def put(self, key: str, values: np.ndarray) -> None:
+        """Store `values` under `key` in memory and on disk."""
+        values = np.array(values, dtype=float)
+        path = self._path(key)
+        # Write under a temporary name first so readers never see a partial file
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, values)
+        os.replace(path + '.tmp', path)
+        self._remember(key, values)
+        self._evict()
+
+    def _remember(self, key: str, values: np.ndarray) -> None:
+        values.flags.writeable = False
+        self._memory[key] = values
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        """Delete the least recently used files until the directory fits.
+
+        Several processes may share a directory and evict at the same time,
+        so a file that disappears before it is examined or removed is skipped.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self._memory.pop(name[:-len('.npy')], None)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove every cached value function."""
+        self._memory.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,193 @@
+from dataclasses import dataclass
+from typing import Sequence
+import numpy as np
+from scipy.special import logsumexp
+from .mdp import OptimalGoalPolicy
+
+@dataclass
+class GoalChoiceFit:
+    """Maximum-likelihood fits, one entry per participant.
+
+    `uniform` marks participants clamped to an infinite temperature and
+    `greedy` those clamped to temperature 0; neither needs Newton steps.
+    `converged` is False for participants whose fit stopped at
+    `max_iterations`, whose temperature is then only the last iterate.
+    Participant IDs without any choices get NaN estimates and are False in
+    all three flags.
+    """
+    temperature: np.ndarray
+    inverse_temperature: np.ndarray
+    neg_log_likelihood: np.ndarray
+    n_choices: np.ndarray
+    iterations: int
+    converged: np.ndarray
+    uniform: np.ndarray
+    greedy: np.ndarray
+
+class GoalChoiceModel:
+    """Fits the softmax temperature of `OptimalGoalPolicy` to observed goal choices.
+
+    A choice of goal c has probability exp(v[c] / T) / sum_g exp(v[g] / T).
+    Writing beta = 1 / T, the negative log-likelihood of a participant's n
+    choices is n * logsumexp(beta * v) - beta * sum(v[choices]), so it only
+    depends on the data through n and the summed chosen values. Every
+    participant and every temperature of a grid is then one log-sum-exp
+    over the goal values.
+
+    The negative log-likelihood is convex in beta, with derivative
+    n * (E_beta[v] - mean chosen value) and second derivative
+    n * Var_beta[v]. `fit` solves for the root with Newton steps, safeguarded
+    by bisection, for all participants at once.
+    """
+
+    def __init__(self, values: Sequence[float], chunk_size: int = 256):
+        """Initialize the model.
+
+        Args:
+            values: Value of every goal, indexed by goal ID
+            chunk_size: Number of participants or temperatures evaluated
+                together, which bounds memory
+        """
+        self.values = np.asarray(values, dtype=float)
+        if self.values.ndim != 1 or not len(self.values):
+            raise ValueError("values must be a non-empty vector")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_policy(cls, policy: OptimalGoalPolicy, **kwargs) -> 'GoalChoiceModel':
+        """Return the model of a policy; goal IDs index `policy.states`."""
+        return cls(policy.state_values, **kwargs)
+
+    def sufficient_statistics(self, choices: Sequence[int],
+                              participants: Sequence[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the number of choices and summed chosen value per participant.
+
+        Args:
+            choices: Chosen goal IDs
+            participants: Optional participant ID (0, 1, ...) of each choice.
+                All choices belong to one participant if omitted.
+        """
+        choices = np.asarray(choices, dtype=int)
+        if participants is None:
+            participants = np.zeros(len(choices), dtype=int)
+        participants = np.asarray(participants, dtype=int)
+        if participants.shape != choices.shape:
+            raise ValueError("participants must have one entry per choice")
+        n_choices = np.bincount(participants)
+        chosen_values = np.bincount(participants, weights=self.values[choices], minlength=len(n_choices))
+        return n_choices, chosen_values
+
+    def _log_partition(self, betas: np.ndarray) -> np.ndarray:
+        """Return logsumexp(beta * values) for every beta."""
+        if not len(betas):
+            return np.zeros(0)
+        return np.concatenate([
+            logsumexp(betas[start:start + self.chunk_size, None] * self.values, axis=1)
+            for start in range(0, len(betas), self.chunk_size)
+        ])
+
+    def _moments(self, betas: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the mean and variance of the values under softmax(beta * values)."""
+        means, variances = np.empty(len(betas)), np.empty(len(betas))
+        centered_values = self.values - self.values.max()
+        for start in range(0, len(betas), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            weights = np.exp(betas[chunk, None] * centered_values)
+            weights /= weights.sum(axis=1, keepdims=True)
+            means[chunk] = weights @ self.values
+            variances[chunk] = np.maximum(weights @ self.values ** 2 - means[chunk] ** 2, 0.0)
+        return means, variances
+
+    def neg_log_likelihood(self, choices: Sequence[int], temperatures: Sequence[float],
+                           participants: Sequence[int] = None) -> np.ndarray:
+        """Return the negative log-likelihood of the choices at every temperature.
+
+        Returns:
+            np.ndarray: Array of shape (n_participants, len(temperatures))
+        """
+        betas = 1.0 / np.asarray(temperatures, dtype=float)
+        n_choices, chosen_values = self.sufficient_statistics(choices, participants)
+        return n_choices[:, None] * self._log_partition(betas) - chosen_values[:, None] * betas
+
+    def grid_search(self, choices: Sequence[int], temperatures: Sequence[float],
+                    participants: Sequence[int] = None) -> np.ndarray:
+        """Return the temperature of the grid with the lowest negative log-likelihood per participant."""
+        temperatures = np.asarray(temperatures, dtype=float)
+        nll = self.neg_log_likelihood(choices, temperatures, participants)
+        return temperatures[nll.argmin(axis=1)]
+
+    def fit(self, choices: Sequence[int],
+            participants: Sequence[int] = None,
+            tol: float = 1e-10,
+            max_iterations: int = 100) -> GoalChoiceFit:
+        """Fit each participant's temperature by maximum likelihood.
+
+        Participants whose mean chosen value is at most the mean goal value
+        get an infinite temperature (uniform choice), and those who always
+        chose a best goal get temperature 0. Participant IDs with no choices
+        have nothing to fit and get NaN.
+
+        Args:
+            choices: Chosen goal IDs
+            participants: Optional participant ID (0, 1, ...) of each choice
+            tol: Convergence threshold on the gradient per choice
+            max_iterations: Maximum number of Newton steps
+
+        Returns:
+            GoalChoiceFit: Fitted temperatures, their negative log-likelihoods,
+            and which participants were clamped or did not converge
+        """
+        n_choices, chosen_values = self.sufficient_statistics(choices, participants)
+        empty = n_choices == 0
+        target = chosen_values / np.maximum(n_choices, 1)
+        top = self.values.max()
+        uniform = ~empty & (target <= self.values.mean())
+        greedy = ~empty & ~uniform & (target >= top)
+
+        betas = np.where(uniform, 0.0, np.where(greedy, np.inf, 1.0))
+        betas[empty] = np.nan
+        lower = np.zeros(len(betas))
+        upper = np.full(len(betas), np.inf)
+        active = np.flatnonzero(~empty & ~uniform & ~greedy)
+        iterations = 0
+        while active.size and iterations < max_iterations:
+            iterations += 1
+            beta = betas[active]
+            means, variances = self._moments(beta)
+            gradient = means - target[active]
+            done = np.abs(gradient) <= tol
+            # The gradient increases with beta, which brackets the root
+            lower[active] = np.where(gradient < 0, beta, lower[active])
+            upper[active] = np.where(gradient > 0, beta, upper[active])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = beta - gradient / variances
+            inside = (newton > lower[active]) & (newton < upper[active])
+            bisection = np.where(np.isfinite(upper[active]),
+                                 (lower[active] + upper[active]) / 2, 2 * beta + 1)
+            betas[active] = np.where(done, beta, np.where(inside, newton, bisection))
+            active = active[~done]
+        converged = np.ones(len(betas), dtype=bool)
+        converged[active] = False
+        converged[empty] = False
+        if active.size:
+            print(f"Warning: {active.size} fits reached maximum iterations without converging")
+
+        nll = np.full(len(betas), np.nan)
+        finite = np.isfinite(betas)
+        nll[finite] = n_choices[finite] * self._log_partition(betas[finite]) - chosen_values[finite] * betas[finite]
+        # At temperature 0 the choice is uniform over the best goals
+        nll[greedy] = n_choices[greedy] * np.log(np.sum(self.values == top))
+        with np.errstate(divide='ignore'):
+            temperatures = 1.0 / betas
+        return GoalChoiceFit(
+            temperature=temperatures,
+            inverse_temperature=betas,
+            neg_log_likelihood=nll,
+            n_choices=n_choices,
+            iterations=iterations,
+            converged=converged,
+            uniform=uniform,
+            greedy=greedy
+        )
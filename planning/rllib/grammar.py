@@ -0,0 +1,416 @@
+import heapq
+from dataclasses import dataclass
+from itertools import count
+from math import log
+from typing import Iterator, Sequence
+import numpy as np
+
+@dataclass
+class ProgramDistribution:
+    """Exact probabilities of the programs a grammar generates.
+
+    `programs` holds (program, probability, lp) triples sorted by decreasing
+    probability, where lp is the mean log-probability of the program's
+    derivations, as `Grammar.py` estimates it from samples. `cap_mass` is
+    the probability of needing more than the expansion budget, and
+    `pruned_mass` is the probability of the derivations dropped by
+    `min_prob`.
+    """
+    programs: list
+    cap_mass: float
+    pruned_mass: float
+
+    def __iter__(self):
+        return iter(self.programs)
+
+class CompiledGrammar:
+    """A PCFG over single-character non-terminals, compiled to integer arrays.
+
+    Rules are given as in `PCFGGoalPolicy`: a list of [non-terminal,
+    [production, ...]] pairs, each production a string in which every
+    character naming a non-terminal is expanded and everything else is
+    literal text. Productions of a non-terminal are equally likely.
+
+    Every production is tokenized once into symbol IDs: non-terminals are
+    0 .. n_non_terminals - 1 and each run of literal text is one terminal
+    symbol after them. Programs are drawn in batches by rewriting every
+    non-terminal of every program at once on a flat token array, so there
+    is no string searching and no recursion.
+
+    Sampling matches `PCFGGoalPolicy.generate_tree`. The final program
+    and its log-probability do not depend on the order in which
+    non-terminals are expanded, and neither does the number of expansions.
+    A program is therefore rejected exactly when its derivation needs more
+    than `cap + 1` expansions, which is when `generate_tree` returns None.
+    """
+
+    def __init__(self, p_rules: Sequence, cap: int = 10):
+        """Compile the rules.
+
+        Args:
+            p_rules: List of [non-terminal, list of productions] pairs
+            cap: Depth cap of `generate_tree`
+        """
+        self.non_terminals = [rule[0] for rule in p_rules]
+        if any(len(nt) != 1 for nt in self.non_terminals):
+            raise ValueError("non-terminals must be single characters")
+        if any(not rule[1] for rule in p_rules):
+            raise ValueError("every non-terminal needs at least one production")
+        self.cap = cap
+        self.symbol_index = {nt: i for i, nt in enumerate(self.non_terminals)}
+        self.terminals = []
+        self._terminal_index = {}
+        self.terminal_text = np.array([''] * len(self.non_terminals), dtype=object)
+
+        productions = [[self.tokenize(p) for p in rule[1]] for rule in p_rules]
+        self.n_choices = np.array([len(options) for options in productions])
+        self.first_production = np.concatenate([[0], np.cumsum(self.n_choices)[:-1]])
+        self.log_choice_prob = -np.log(self.n_choices)
+        flat = [tokens for options in productions for tokens in options]
+        self.production_length = np.array([len(tokens) for tokens in flat])
+        self.production_tokens = np.full((len(flat), max(self.production_length.max(), 1)), -1)
+        for i, tokens in enumerate(flat):
+            self.production_tokens[i, :len(tokens)] = tokens
+        self._option_table = None
+
+    def tokenize(self, text: str) -> list[int]:
+        """Return the symbol IDs of a string, adding new terminals as needed."""
+        tokens = []
+        literal = ''
+        for char in text:
+            if char in self.symbol_index:
+                if literal:
+                    tokens.append(self._terminal(literal))
+                    literal = ''
+                tokens.append(self.symbol_index[char])
+            else:
+                literal += char
+        if literal:
+            tokens.append(self._terminal(literal))
+        return tokens
+
+    def _terminal(self, text: str) -> int:
+        if text not in self._terminal_index:
+            self._terminal_index[text] = len(self.non_terminals) + len(self.terminals)
+            self.terminals.append(text)
+            # Start forms may add terminals after the productions are compiled
+            self.terminal_text = np.append(self.terminal_text, np.array([text], dtype=object))
+        return self._terminal_index[text]
+
+    def sample(self, n: int, rng: np.random.Generator, start: str = 'S',
+               log_prob: float = 0.0, depth: int = 0) -> list:
+        """Draw `n` programs.
+
+        Args:
+            n: Number of programs
+            rng: NumPy random generator
+            start: Sentential form to expand
+            log_prob: Log-probability already accumulated by `start`
+            depth: Expansions already made to reach `start`
+
+        Returns:
+            list: For each draw, a (program, log_prob) pair, or None if it
+            exceeded the depth cap
+        """
+        start_tokens = np.array(self.tokenize(start), dtype=int)
+        n_non_terminals = len(self.non_terminals)
+        tokens = np.tile(start_tokens, n)
+        owner = np.repeat(np.arange(n), len(start_tokens))
+        log_probs = np.full(n, float(log_prob))
+        depths = np.full(n, depth)
+        failed = np.zeros(n, dtype=bool)
+        if not (start_tokens < n_non_terminals).any():
+            raise ValueError("start must contain a non-terminal")
+
+        while True:
+            expand = tokens < n_non_terminals
+            if not expand.any():
+                break
+            symbols = tokens[expand]
+            productions = self.first_production[symbols] + (
+                rng.random(len(symbols)) * self.n_choices[symbols]
+            ).astype(int)
+            depths += np.bincount(owner[expand], minlength=n)
+            log_probs += np.bincount(owner[expand], weights=self.log_choice_prob[symbols], minlength=n)
+
+            # Rewrite each non-terminal into its production's tokens
+            lengths = np.ones(len(tokens), dtype=int)
+            lengths[expand] = self.production_length[productions]
+            source = np.repeat(np.arange(len(tokens)), lengths)
+            offset = np.arange(len(source)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            production_of = np.zeros(len(tokens), dtype=int)
+            production_of[expand] = productions
+            tokens = np.where(expand[source], self.production_tokens[production_of[source], offset], tokens[source])
+            owner = owner[source]
+
+            # Drop derivations that already need more expansions than the cap
+            # allows; generate_tree only checks the cap between expansions
+            over = (depths > self.cap + 1) & (depths > depth + 1)
+            if over.any():
+                failed |= over
+                keep = ~failed[owner]
+                tokens, owner = tokens[keep], owner[keep]
+
+        # `owner` is sorted, so each program's tokens are contiguous
+        bounds = np.searchsorted(owner, np.arange(n + 1))
+        texts = self.terminal_text[tokens]
+        return [
+            None if failed[i] else (''.join(texts[bounds[i]:bounds[i + 1]]), float(log_probs[i]))
+            for i in range(n)
+        ]
+
+    def expansion_counts(self, max_expansions: int) -> np.ndarray:
+        """Return the distribution of the number of expansions from each non-terminal.
+
+        Returns:
+            np.ndarray: Array of shape (n_non_terminals, max_expansions + 1);
+            entry (nt, k) is the probability that expanding nt fully takes
+            exactly k expansions
+        """
+        n_non_terminals = len(self.non_terminals)
+        counts = np.zeros((n_non_terminals, max_expansions + 1))
+        # A derivation with k expansions is at most k deep, so after
+        # max_expansions rounds every count up to max_expansions is exact
+        for _ in range(max_expansions):
+            updated = np.zeros_like(counts)
+            for nt in range(n_non_terminals):
+                first = self.first_production[nt]
+                for production in range(first, first + self.n_choices[nt]):
+                    total = np.zeros(max_expansions + 1)
+                    total[0] = 1.0
+                    for token in self.production_tokens[production, :self.production_length[production]]:
+                        if token < n_non_terminals:
+                            total = np.convolve(total, counts[token])[:max_expansions + 1]
+                    updated[nt, 1:] += total[:-1] / self.n_choices[nt]
+            counts = updated
+        return counts
+
+    def cap_mass(self, start: str = 'S') -> float:
+        """Return the probability that `sample` rejects a draw for exceeding the cap."""
+        return float(1.0 - self._start_counts(start, self.cap + 1).sum())
+
+    def _start_counts(self, start: str, max_expansions: int) -> np.ndarray:
+        counts = self.expansion_counts(max_expansions)
+        total = np.zeros(max_expansions + 1)
+        total[0] = 1.0
+        for token in self.tokenize(start):
+            if token < len(self.non_terminals):
+                total = np.convolve(total, counts[token])[:max_expansions + 1]
+        return total
+
+    def _combine(self, tables: list, min_prob: float, max_expansions: int) -> dict:
+        """Return the table of a sequence of symbols from the tables of its symbols.
+
+        Tables map (text, expansions) to (probability, sum of probability x
+        log-probability) over derivations, sorted by decreasing probability.
+        """
+        combined = {('', 0): (1.0, 0.0)}
+        for table in tables:
+            result = {}
+            for (text, k), (prob, moment) in combined.items():
+                for (next_text, next_k), (next_prob, next_moment) in table:
+                    if prob * next_prob < min_prob:
+                        break
+                    if k + next_k > max_expansions:
+                        continue
+                    key = (text + next_text, k + next_k)
+                    old_prob, old_moment = result.get(key, (0.0, 0.0))
+                    result[key] = (old_prob + prob * next_prob,
+                                   old_moment + next_prob * moment + prob * next_moment)
+            combined = result
+        return combined
+
+    def _budget(self, max_expansions: int) -> int:
+        if max_expansions is None:
+            return self.cap + 1
+        if max_expansions <= 0:
+            raise ValueError("max_expansions must be positive")
+        return max_expansions
+
+    def enumerate_programs(self, min_prob: float = 1e-6, start: str = 'S',
+                           max_expansions: int = None) -> ProgramDistribution:
+        """Compute the exact probability of every likely program.
+
+        The expansions of each non-terminal are tabulated once per tree
+        height and reused wherever it occurs. Every derivation with
+        probability at least `min_prob` and at most `max_expansions`
+        expansions is included; pruning only drops parts whose probability
+        is already below `min_prob`.
+
+        For recursive grammars much of the mass can lie in many improbable
+        programs, so check `pruned_mass` before relying on the result, and
+        use `iter_programs` to stream programs without fixing `min_prob`.
+
+        Args:
+            min_prob: Probability below which partial derivations are dropped
+            start: Sentential form to expand
+            max_expansions: Expansion budget per derivation; defaults to
+                cap + 1, the most that `sample` accepts
+
+        Returns:
+            ProgramDistribution: Programs sorted by decreasing probability
+        """
+        if min_prob <= 0:
+            raise ValueError("min_prob must be positive")
+        max_expansions = self._budget(max_expansions)
+        n_non_terminals = len(self.non_terminals)
+        terminal_tables = {
+            token: [((text, 0), (1.0, 0.0))]
+            for token, text in enumerate(self.terminal_text) if token >= n_non_terminals
+        }
+        tables = [[] for _ in range(n_non_terminals)]
+
+        def symbol_tables(tokens):
+            return [tables[t] if t < n_non_terminals else terminal_tables[t] for t in tokens]
+
+        # Height-h tables hold the derivations at most h deep; they stop
+        # changing once deeper derivations all fall below min_prob
+        for _ in range(max_expansions):
+            updated = []
+            for nt in range(n_non_terminals):
+                table = {}
+                log_choice = float(self.log_choice_prob[nt])
+                choice = 1.0 / self.n_choices[nt]
+                first = self.first_production[nt]
+                for production in range(first, first + self.n_choices[nt]):
+                    tokens = self.production_tokens[production, :self.production_length[production]]
+                    combined = self._combine(symbol_tables(tokens), min_prob / choice, max_expansions - 1)
+                    for (text, k), (prob, moment) in combined.items():
+                        old_prob, old_moment = table.get((text, k + 1), (0.0, 0.0))
+                        table[(text, k + 1)] = (old_prob + choice * prob,
+                                                old_moment + choice * (moment + prob * log_choice))
+                updated.append(sorted(table.items(), key=lambda item: -item[1][0]))
+            if updated == tables:
+                break
+            tables = updated
+
+        start_tokens = self.tokenize(start)
+        if not any(t < n_non_terminals for t in start_tokens):
+            raise ValueError("start must contain a non-terminal")
+        programs = {}
+        for (text, _), (prob, moment) in self._combine(symbol_tables(start_tokens), min_prob,
+                                                       max_expansions).items():
+            old_prob, old_moment = programs.get(text, (0.0, 0.0))
+            programs[text] = (old_prob + prob, old_moment + moment)
+        ranked = sorted(
+            ((text, float(prob), float(moment / prob)) for text, (prob, moment) in programs.items()),
+            key=lambda item: -item[1]
+        )
+        cap_mass = float(1.0 - self._start_counts(start, max_expansions).sum())
+        found = sum(prob for _, prob, _ in ranked)
+        return ProgramDistribution(ranked, cap_mass, max(1.0 - cap_mass - found, 0.0))
+
+    def _options(self) -> list:
+        """Return the ways of expanding each non-terminal, most probable first.
+
+        A non-terminal that cannot reach a recursive one generates finitely
+        many strings, so its options are its complete derivations, as
+        (text, (), log_prob, expansions). Any other non-terminal keeps its
+        productions, as ('', tokens, log_prob, 1).
+        """
+        if self._option_table is not None:
+            return self._option_table
+        n_non_terminals = len(self.non_terminals)
+        productions = [
+            [tuple(int(t) for t in self.production_tokens[p, :self.production_length[p]])
+             for p in range(first, first + n)]
+            for first, n in zip(self.first_production, self.n_choices)
+        ]
+        reachable = [{t for tokens in options for t in tokens if t < n_non_terminals}
+                     for options in productions]
+        changed = True
+        while changed:
+            changed = False
+            for nt in range(n_non_terminals):
+                closure = reachable[nt].union(*(reachable[t] for t in reachable[nt]))
+                changed |= closure != reachable[nt]
+                reachable[nt] = closure
+        finite = [nt not in reachable[nt] and all(t not in reachable[t] for t in reachable[nt])
+                  for nt in range(n_non_terminals)]
+
+        derivations = {}
+        def derive(nt):
+            if nt not in derivations:
+                result = []
+                for tokens in productions[nt]:
+                    partial = [('', float(self.log_choice_prob[nt]), 1)]
+                    for t in tokens:
+                        parts = derive(t) if t < n_non_terminals else [(self.terminal_text[t], 0.0, 0)]
+                        partial = [(text + part, lp + part_lp, k + part_k)
+                                   for text, lp, k in partial for part, part_lp, part_k in parts]
+                    result.extend(partial)
+                derivations[nt] = result
+            return derivations[nt]
+
+        self._option_table = [
+            sorted(((text, (), lp, k) for text, lp, k in derive(nt)), key=lambda option: -option[2])
+            if finite[nt] else
+            [('', tokens, float(self.log_choice_prob[nt]), 1) for tokens in productions[nt]]
+            for nt in range(n_non_terminals)
+        ]
+        return self._option_table
+
+    def iter_programs(self, start: str = 'S', max_expansions: int = None,
+                      min_prob: float = 0.0) -> Iterator[tuple[str, float]]:
+        """Lazily yield derivations in order of decreasing probability.
+
+        This is a best-first search over leftmost derivations. Each queue
+        entry is a partial derivation whose leading terminals are already
+        joined into text. Popping an entry pushes its most probable
+        expansion and the next most probable sibling of the entry itself,
+        so the queue grows by at most two entries per step. Non-recursive
+        non-terminals are expanded in one step from their memoized
+        derivations (see `_options`).
+
+        Args:
+            start: Sentential form to expand
+            max_expansions: Expansion budget per derivation; defaults to
+                cap + 1, the most that `sample` accepts
+            min_prob: Probability below which derivations are not generated
+
+        Yields:
+            tuple: (program, log_prob) per derivation, as returned by
+            `sample`. A program with several derivations is yielded once
+            for each.
+        """
+        max_expansions = self._budget(max_expansions)
+        min_log_prob = log(min_prob) if min_prob > 0 else float('-inf')
+        n_non_terminals = len(self.non_terminals)
+        options = self._options()
+        tie_breaker = count()
+        queue = []
+
+        def push(lp, text, rest, k, option):
+            # Push the first option from `option` on that fits the budget
+            choices = options[rest[0]]
+            for i in range(option, len(choices)):
+                option_text, tokens, option_lp, option_k = choices[i]
+                if lp + option_lp < min_log_prob:
+                    return
+                if k + option_k <= max_expansions:
+                    new_text, new_rest = text + option_text, tokens + rest[1:]
+                    j = 0
+                    while j < len(new_rest) and new_rest[j] >= n_non_terminals:
+                        new_text += self.terminal_text[new_rest[j]]
+                        j += 1
+                    heapq.heappush(queue, (-(lp + option_lp), next(tie_breaker), new_text,
+                                           new_rest[j:], k + option_k, (lp, text, rest, k, i)))
+                    return
+
+        start_tokens = tuple(self.tokenize(start))
+        if not any(t < n_non_terminals for t in start_tokens):
+            raise ValueError("start must contain a non-terminal")
+        j = 0
+        while start_tokens[j] >= n_non_terminals:
+            j += 1
+        text = ''.join(self.terminal_text[list(start_tokens[:j])])
+        queue.append((0.0, next(tie_breaker), text, start_tokens[j:], 0, None))
+        while queue:
+            neg_lp, _, text, rest, k, parent = heapq.heappop(queue)
+            if parent is not None:
+                parent_lp, parent_text, parent_rest, parent_k, option = parent
+                push(parent_lp, parent_text, parent_rest, parent_k, option + 1)
+            if not rest:
+                yield text, -neg_lp
+            else:
+                push(-neg_lp, text, rest, k, 0)
@@ -0,0 +1,193 @@
+import re
+from typing import Sequence
+import numpy as np
+from .shapeworld import ShapeWorld
+
+class ProgramCompiler:
+    """Compiles PCFG goal programs into packed bitmasks over ShapeWorld states.
+
+    Programs are those of the grammar in `pcfg/Grammar.py`:
+    - `and(P, Q, ...)` holds when every argument holds
+    - `same(B, C)` / `unique(B, C)` compare the objects picked by B on C
+
+    B picks objects: `everything` is all three slots, `a`/`b`/`c` one
+    slot and `ab`/`ac`/`bc` a pair. `one` and `two` hold when some single
+    slot or some pair of slots satisfies the comparison.
+
+    C is what is compared. For `shape`, `color`, `texture` and `true` (all
+    features at once), `same` means the objects agree and `unique` means
+    they all differ. For a feature value such as `square`, `same` means every
+    object has it and `unique` means exactly one does. Feature values use the
+    grammar's names, which are mapped onto ShapeWorld's by `VALUE_ALIASES`.
+
+    A single object agrees with itself, so single-slot groups (`a`, `b`,
+    `c` and each slot of `one`) are compared with the other two objects
+    instead: `same(a, shape)` means some other object has a's shape and
+    `unique(a, shape)` means none does. With a feature value, `same(a,
+    square)` means a is a square and `unique(a, square)` means a is the
+    only square.
+
+    Each program is evaluated over the decoded feature array of every
+    state at once, and results are packed eight states per byte, with state
+    i at bit i % 8 of byte i // 8. Every subexpression's mask is
+    memoized under its canonical text, so programs sharing parts, as
+    sampled programs mostly do, reuse them.
+    """
+
+    GROUPS = {
+        'everything': [(0, 1, 2)],
+        'a': [(0,)], 'b': [(1,)], 'c': [(2,)],
+        'ab': [(0, 1)], 'ac': [(0, 2)], 'bc': [(1, 2)],
+        'one': [(0,), (1,), (2,)],
+        'two': [(0, 1), (0, 2), (1, 2)],
+    }
+    # Feature dimensions by name, indexing the last axis of decoded states
+    DIMENSIONS = {'shape': 0, 'color': 1, 'texture': 2}
+    VALUE_ALIASES = {'light': 'low', 'dark': 'high', 'stripe': 'stripes'}
+    TOKEN_PATTERN = re.compile(r'\s*([A-Za-z_0-9]+|[(),])')
+
+    def __init__(self, world: type[ShapeWorld] = ShapeWorld):
+        """Decode the state space of `world` once.
+
+        Args:
+            world: ShapeWorld class providing the feature lists and encoding
+        """
+        self.world = world
+        self.n_states = world.num_shapes() ** 3
+        ids = np.arange(self.n_states)
+        self.features = world.decode_states(ids)
+        self.shape_ids = world.decode_slots(ids)
+        self.values = {}
+        for dimension, names in enumerate((world.SHAPE_LIST, world.SHADE_LIST, world.TEXTURE_LIST)):
+            for index, name in enumerate(names):
+                self.values[name] = (dimension, index)
+        for alias, name in self.VALUE_ALIASES.items():
+            if name in self.values:
+                self.values[alias] = self.values[name]
+        self._cache = {}
+
+    def parse(self, program: str) -> tuple:
+        """Parse a program into nested (name, arguments) tuples."""
+        tokens = self.TOKEN_PATTERN.findall(program)
+        if ''.join(tokens) != re.sub(r'\s+', '', program):
+            raise ValueError(f"Cannot tokenize program: {program!r}")
+        malformed = ValueError(f"Malformed program: {program!r}")
+        # Explicit stack of (name, arguments) for the calls being parsed
+        stack = [('', [])]
+        position = 0
+        while position < len(tokens):
+            name = tokens[position]
+            if name in ('(', ')', ','):
+                raise malformed
+            if position + 1 < len(tokens) and tokens[position + 1] == '(':
+                stack.append((name, []))
+                position += 2
+                continue
+            stack[-1][1].append((name, ()))
+            position += 1
+            # Close finished calls, then expect a separator or the end
+            while position < len(tokens) and tokens[position] == ')' and len(stack) > 1:
+                name, arguments = stack.pop()
+                stack[-1][1].append((name, tuple(arguments)))
+                position += 1
+            if position < len(tokens):
+                if tokens[position] != ',' or len(stack) == 1:
+                    raise malformed
+                position += 1
+                if position == len(tokens):
+                    raise malformed
+        if len(stack) != 1 or len(stack[0][1]) != 1:
+            raise malformed
+        return stack[0][1][0]
+
+    @staticmethod
+    def to_text(expression: tuple) -> str:
+        """Return the canonical text of a parsed expression."""
+        name, arguments = expression
+        if not arguments:
+            return name
+        return f"{name}({','.join(ProgramCompiler.to_text(a) for a in arguments)})"
+
+    def compile(self, program: str) -> np.ndarray:
+        """Return the packed mask of the states satisfying `program`.
+
+        Returns:
+            np.ndarray: uint8 array of ceil(n_states / 8) bytes
+        """
+        return self._evaluate(self.parse(program))
+
+    def compile_many(self, programs: Sequence[str]) -> np.ndarray:
+        """Return the packed masks of many programs as an (n_programs, n_bytes) array."""
+        return np.stack([self.compile(p) for p in programs])
+
+    def unpack(self, masks: np.ndarray) -> np.ndarray:
+        """Return boolean arrays over the states from packed masks."""
+        return np.unpackbits(masks, axis=-1, count=self.n_states, bitorder='little').astype(bool)
+
+    def satisfying_states(self, program: str) -> np.ndarray:
+        """Return the IDs of the states satisfying `program`."""
+        return np.flatnonzero(self.unpack(self.compile(program)))
+
+    def count(self, masks: np.ndarray) -> np.ndarray:
+        """Return the number of states set in each packed mask."""
+        return np.unpackbits(masks, axis=-1).sum(axis=-1)
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _evaluate(self, expression: tuple) -> np.ndarray:
+        key = self.to_text(expression)
+        if key not in self._cache:
+            name, arguments = expression
+            if name == 'and' and arguments:
+                mask = self._evaluate(arguments[0])
+                for argument in arguments[1:]:
+                    mask = mask & self._evaluate(argument)
+            elif name in ('same', 'unique') and len(arguments) == 2:
+                holds = self._compare(name, arguments[0], arguments[1])
+                mask = np.packbits(holds, bitorder='little')
+            else:
+                raise ValueError(f"Unknown expression: {key!r}")
+            mask.flags.writeable = False
+            self._cache[key] = mask
+        return self._cache[key]
+
+    def _compare(self, name: str, group: tuple, criterion: tuple) -> np.ndarray:
+        """Return whether some slot set of `group` satisfies the comparison, per state."""
+        group_name, criterion_name = group[0], criterion[0]
+        if group[1] or group_name not in self.GROUPS:
+            raise ValueError(f"Unknown object group: {self.to_text(group)!r}")
+        if criterion[1]:
+            raise ValueError(f"Unknown criterion: {self.to_text(criterion)!r}")
+        if criterion_name in self.values:
+            dimension, index = self.values[criterion_name]
+            has = self.features[:, :, dimension] == index
+        elif criterion_name == 'true':
+            values = self.shape_ids
+        elif criterion_name in self.DIMENSIONS:
+            values = self.features[:, :, self.DIMENSIONS[criterion_name]]
+        else:
+            raise ValueError(f"Unknown criterion: {criterion_name!r}")
+        holds = np.zeros(self.n_states, dtype=bool)
+        for slots in self.GROUPS[group_name]:
+            slots = list(slots)
+            if len(slots) == 1:
+                # A single object is compared with the other two
+                slot = slots[0]
+                others = [s for s in range(self.features.shape[1]) if s != slot]
+                if criterion_name in self.values:
+                    only = ~has[:, others].any(axis=1)
+                    holds |= has[:, slot] if name == 'same' else has[:, slot] & only
+                else:
+                    shared = (values[:, others] == values[:, [slot]]).any(axis=1)
+                    holds |= shared if name == 'same' else ~shared
+            elif criterion_name in self.values:
+                has_slots = has[:, slots]
+                holds |= has_slots.all(axis=1) if name == 'same' else has_slots.sum(axis=1) == 1
+            else:
+                pairs = [(i, j) for i in slots for j in slots if i < j]
+                if name == 'same':
+                    holds |= np.all([values[:, i] == values[:, j] for i, j in pairs], axis=0)
+                else:
+                    holds |= np.all([values[:, i] != values[:, j] for i, j in pairs], axis=0)
+        return holds
@@ -1,9 +1,10 @@
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
 from typing import Sequence, Tuple, Dict
-from itertools import product
+from itertools import product, permutations
 import random
 from random import Random
 import numpy as np
+from scipy import sparse
 import matplotlib.pyplot as plt
 from collections import Counter
 from dataclasses import dataclass
@@ -107,6 +108,24 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
     SHAPE_TRANSITION_PROB = 0.9
     TEXTURE_TRANSITION_PROB = 1.0
     SHADE_CYCLE_PROB = 0.1  # you changed this to 10%
+
+    # Orderings of the three slots; the dynamics are invariant under all of them
+    SLOT_PERMUTATIONS = tuple(permutations(range(3)))
+
+    # Number of transition parameter settings whose kernels stay cached. Sweeps
+    # visit many settings, so older ones are dropped, least recently used first
+    PARAMETER_CACHE_SIZE = 4
+    # Goal-independent transition kernels, shared by every ShapeWorld instance
+    # with the same transition parameters
+    _transition_cache = OrderedDict()
+    # Shape and state spaces, shared by every instance of the same class
+    _space_cache = {}
+    # Shape-pair kernels, keyed like the transition kernels
+    _pair_kernel_cache = OrderedDict()
+    # Reverse transition structure, keyed like the transition kernels
+    _predecessor_cache = OrderedDict()
+    # Parameter-independent sparsity pattern of the transition kernels
+    _pattern_cache = {}
     
     def __init__(self, goal: State, discount_rate: float):
         '''Initialize the ShapeWorld with a goal state and discount rate.'''
@@ -117,21 +136,12 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
         self.GOAL_REWARD = 0  # zero because of averaging across Q-tables we do later
         self.STEP_COST = -1
         
-        # Set up shape space using class constants
-        shape_space = [
-            Shape(sides=sides, shade=shade, texture=texture)
-            for sides, shade, texture in product(
-                self.SHAPE_LIST,
-                self.SHADE_LIST,
-                self.TEXTURE_LIST
-            )
-        ]
+        # Set up shape and state spaces using class constants
+        self.shape_space, self.state_space = self.build_spaces()
         
-        # Set up state space
-        self.state_space = [
-            State(shape1=shape1, shape2=shape2, shape3=shape3)
-            for shape1, shape2, shape3 in product(shape_space, shape_space, shape_space)
-        ]
+        # Integer form of the state space: IDs and (state, slot, feature) indices
+        self.state_ids = np.arange(len(self.state_space))
+        self.state_features = self.decode_states(self.state_ids)
         
         # Set up action space
         self.action_space = [
@@ -147,67 +157,20 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
         '''
         Given a state and action, return a possible next state.
         
+        The recipient's new shape is drawn from the shape-pair kernel row of
+        the (actor, recipient) pair; every other slot is unchanged.
+        
         Note on indexing:
         - Action.actor and Action.recipient are 1-based (1,2,3)
-        - Python list indexing is 0-based (0,1,2)
         - State attributes are accessed by name (shape1, shape2, shape3)
         '''
-        # Get shapes using proper attribute names
-        actor_shape = getattr(s, f'shape{a.actor}')
-        recipient_shape = getattr(s, f'shape{a.recipient}')
-        
-        # 1. Determine recipient's new shape
-        if rng.random() < self.SHAPE_TRANSITION_PROB:
-            sides = actor_shape.sides
-        else:
-            available_shapes = [shape for shape in self.SHAPE_LIST if shape != actor_shape.sides]
-            sides = rng.choice(available_shapes)
-        
-        # 2. Determine recipient's new texture
-        current_texture_idx = self.TEXTURE_LIST.index(recipient_shape.texture)
-        next_texture_idx = (current_texture_idx + 1) % len(self.TEXTURE_LIST)
-        texture = self.TEXTURE_LIST[next_texture_idx]
-        
-        # 3. Determine recipient's new shade
-        actor_shade_idx = self.SHADE_LIST.index(actor_shape.shade)
-        recipient_shade_idx = self.SHADE_LIST.index(recipient_shape.shade)
-        
-        if actor_shade_idx == recipient_shade_idx:
-            # Same shade case
-            if recipient_shape.shade in ['low', 'high']:
-                if rng.random() < self.SHADE_CYCLE_PROB:
-                    # Equal chance to cycle around or go to medium
-                    if rng.random() < 0.5:
-                        shade = 'high' if recipient_shape.shade == 'low' else 'low'
-                    else:
-                        shade = 'medium'
-                else:
-                    shade = recipient_shape.shade
-            elif recipient_shape.shade == 'medium':
-                if rng.random() < self.SHADE_CYCLE_PROB:
-                    shade = rng.choice(['low', 'high'])
-                else:
-                    shade = 'medium'
-        else:
-            # Different shade case: move one step towards actor's shade
-            if actor_shade_idx > recipient_shade_idx:
-                shade = self.SHADE_LIST[recipient_shade_idx + 1]
-            else:
-                shade = self.SHADE_LIST[recipient_shade_idx - 1]
-        
-        # Create new state using proper attribute names
-        new_shapes = {
-            'shape1': s.shape1,
-            'shape2': s.shape2,
-            'shape3': s.shape3
-        }
-        new_shapes[f'shape{a.recipient}'] = Shape(sides=sides, shade=shade, texture=texture)
-        
-        return State(
-            shape1=new_shapes['shape1'],
-            shape2=new_shapes['shape2'],
-            shape3=new_shapes['shape3']
-        )
+        actor_id = self.shape_id(getattr(s, f'shape{a.actor}'))
+        recipient_id = self.shape_id(getattr(s, f'shape{a.recipient}'))
+        new_shape_id = rng.choices(
+            range(self.num_shapes()),
+            weights=self.shape_pair_kernel()[actor_id, recipient_id]
+        )[0]
+        return self.state_space[self._replace_slot(self.state_id(s), a.recipient, new_shape_id)]
 
     def reward(self, s: State, a: Action, ns: State) -> float:
         """Calculate the reward for a state transition.
@@ -252,63 +215,13 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
             a: Action taken
             
         Returns:
-            Sequence[State]: List of all possible next states
+            Sequence[State]: List of all next states with nonzero probability
         """
-        # Get shapes using proper attribute names
-        actor_shape = getattr(s, f'shape{a.actor}')
-        recipient_shape = getattr(s, f'shape{a.recipient}')
-        
-        # 1. Determine possible sides (80% actor's shape, 20% different shape)
-        possible_sides = [actor_shape.sides]  # 80% chance
-        other_sides = [side for side in self.SHAPE_LIST if side != actor_shape.sides]
-        possible_sides.extend(other_sides)  # 20% chance split among other shapes
-        
-        # 2. Determine possible shades
-        if actor_shape.shade == recipient_shape.shade:
-            # Same shade case
-            if recipient_shape.shade in ['low', 'high']:
-                possible_shades = [
-                    recipient_shape.shade,  # 90% chance stay same
-                    'high' if recipient_shape.shade == 'low' else 'low',  # 5% chance to cycle
-                    'medium'  # 5% chance to go to medium
-                ]
-            elif recipient_shape.shade == 'medium':
-                possible_shades = [
-                    'medium',  # 90% chance stay same
-                    'low',    # 5% chance
-                    'high'    # 5% chance
-                ]
-        else:
-            # Different shade case - move one step towards actor's shade
-            recipient_idx = self.SHADE_LIST.index(recipient_shape.shade)
-            actor_idx = self.SHADE_LIST.index(actor_shape.shade)
-            step = 1 if actor_idx > recipient_idx else -1
-            possible_shades = [self.SHADE_LIST[recipient_idx + step]]
-        
-        # 3. Determine possible textures (cycles through plain -> stripes -> dots)
-        current_texture_idx = self.TEXTURE_LIST.index(recipient_shape.texture)
-        next_texture_idx = (current_texture_idx + 1) % len(self.TEXTURE_LIST)
-        possible_textures = [self.TEXTURE_LIST[next_texture_idx]]
-        
-        # Generate all possible combinations
-        possible_states = set()
-        for sides in possible_sides:
-            for shade in possible_shades:
-                for texture in possible_textures:
-                    # Create new shape with the combination
-                    new_shape = Shape(sides=sides, shade=shade, texture=texture)
-                    
-                    # Create new state, only updating the recipient shape
-                    if a.recipient == 1:
-                        new_state = State(shape1=new_shape, shape2=s.shape2, shape3=s.shape3)
-                    elif a.recipient == 2:
-                        new_state = State(shape1=s.shape1, shape2=new_shape, shape3=s.shape3)
-                    else:  # recipient == 3
-                        new_state = State(shape1=s.shape1, shape2=s.shape2, shape3=new_shape)
-                    
-                    possible_states.add(new_state)
-        
-        return list(possible_states)
+        actor_id = self.shape_id(getattr(s, f'shape{a.actor}'))
+        recipient_id = self.shape_id(getattr(s, f'shape{a.recipient}'))
+        new_shape_ids = np.flatnonzero(self.shape_pair_kernel()[actor_id, recipient_id])
+        next_ids = self._replace_slot(self.state_id(s), a.recipient, new_shape_ids)
+        return self.states_from_ids(next_ids)
     
     def transition_probability(self, s: State, a: Action, ns: State) -> float:
         """Return the transition probability from state s to state ns given action a.
@@ -321,61 +234,15 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
         Returns:
             float: Probability of transitioning from s to ns given action a
         """
-        # Get shapes using proper attribute access
-        actor_shape = getattr(s, f'shape{a.actor}')
-        recipient_shape = getattr(s, f'shape{a.recipient}')
-        next_recipient_shape = getattr(ns, f'shape{a.recipient}')
-        
         # Verify that only the recipient shape changed
-        if (getattr(ns, f'shape{a.actor}') != actor_shape or
-            any(getattr(ns, f'shape{i}') != getattr(s, f'shape{i}') 
-                for i in [1,2,3] if i != a.recipient)):
+        if any(getattr(ns, f'shape{i}') != getattr(s, f'shape{i}')
+               for i in [1, 2, 3] if i != a.recipient):
             return 0.0
         
-        # 1. Check shape transition
-        shape_prob = 0.0
-        if next_recipient_shape.sides == actor_shape.sides:
-            shape_prob = self.SHAPE_TRANSITION_PROB
-        elif next_recipient_shape.sides != actor_shape.sides:
-            available_shapes = [shape for shape in self.SHAPE_LIST if shape != actor_shape.sides]
-            shape_prob = (1 - self.SHAPE_TRANSITION_PROB) / len(available_shapes)
-        else:
-            return 0.0
-
-        # 2. Check texture transition
-        texture_prob = 0.0
-        current_texture_idx = self.TEXTURE_LIST.index(recipient_shape.texture)
-        expected_texture_idx = (current_texture_idx + 1) % len(self.TEXTURE_LIST)
-        if next_recipient_shape.texture == self.TEXTURE_LIST[expected_texture_idx]:
-            texture_prob = 1.0
-        else:
-            return 0.0
-
-        # 3. Check shade transition
-        shade_prob = 0.0
-        if actor_shape.shade == recipient_shape.shade:
-            # Same shade case
-            if recipient_shape.shade in ['low', 'high']:
-                if next_recipient_shape.shade == recipient_shape.shade:
-                    shade_prob = 1 - self.SHADE_CYCLE_PROB
-                elif (recipient_shape.shade == 'low' and next_recipient_shape.shade == 'high' or
-                    recipient_shape.shade == 'high' and next_recipient_shape.shade == 'low'):
-                    shade_prob = self.SHADE_CYCLE_PROB
-            elif recipient_shape.shade == 'medium':
-                if next_recipient_shape.shade == 'medium':
-                    shade_prob = 1 - self.SHADE_CYCLE_PROB
-                elif next_recipient_shape.shade in ['low', 'high']:
-                    shade_prob = self.SHADE_CYCLE_PROB / 2  # Equal chance of low or high
-        else:
-            # Different shade case - move one step towards actor's shade
-            recipient_idx = self.SHADE_LIST.index(recipient_shape.shade)
-            actor_idx = self.SHADE_LIST.index(actor_shape.shade)
-            step = 1 if actor_idx > recipient_idx else -1
-            if next_recipient_shape.shade == self.SHADE_LIST[recipient_idx + step]:
-                shade_prob = 1.0
-
-        # Return combined probability
-        return shape_prob * texture_prob * shade_prob
+        actor_id = self.shape_id(getattr(s, f'shape{a.actor}'))
+        recipient_id = self.shape_id(getattr(s, f'shape{a.recipient}'))
+        new_shape_id = self.shape_id(getattr(ns, f'shape{a.recipient}'))
+        return float(self.shape_pair_kernel()[actor_id, recipient_id, new_shape_id])
 
     def plot_state_transitions(self, state: State, action: Action, n_samples: int = 10000):
         """Visualize state transitions from a given state and action.
@@ -464,6 +331,318 @@ class ShapeWorld(MarkovDecisionProcess[State, Action]):
         '''Return the action space.'''
         return self.action_space
 
+    @classmethod
+    def build_spaces(cls) -> tuple[list[Shape], list[State]]:
+        '''Return the shape and state spaces.
+
+        Both are ordered by their integer IDs (see `encode_shapes` and
+        `encode_states`) and only depend on the class, so they are built once
+        and shared by every instance.
+        '''
+        if cls not in ShapeWorld._space_cache:
+            shape_space = [
+                Shape(sides=sides, shade=shade, texture=texture)
+                for sides, shade, texture in product(
+                    cls.SHAPE_LIST,
+                    cls.SHADE_LIST,
+                    cls.TEXTURE_LIST
+                )
+            ]
+            state_space = [
+                State(shape1=shape1, shape2=shape2, shape3=shape3)
+                for shape1, shape2, shape3 in product(shape_space, shape_space, shape_space)
+            ]
+            ShapeWorld._space_cache[cls] = (shape_space, state_space)
+        return ShapeWorld._space_cache[cls]
+
+    # integer encoding
+    @classmethod
+    def feature_sizes(cls) -> tuple[int, int, int]:
+        '''Return the number of sides, shade and texture values.'''
+        return len(cls.SHAPE_LIST), len(cls.SHADE_LIST), len(cls.TEXTURE_LIST)
+
+    @classmethod
+    def num_shapes(cls) -> int:
+        '''Return the number of distinct shapes.'''
+        return int(np.prod(cls.feature_sizes()))
+
+    @classmethod
+    def encode_shapes(cls, features: np.ndarray) -> np.ndarray:
+        '''Map feature indices to shape IDs.
+
+        Shape IDs are mixed-radix numbers with digits (sides, shade, texture),
+        so they follow the order of the shape space.
+
+        Args:
+            features: Integer array of shape (..., 3) holding the indices of
+                sides, shade and texture in SHAPE_LIST, SHADE_LIST, TEXTURE_LIST
+
+        Returns:
+            np.ndarray: Integer array of shape (...) with shape IDs
+        '''
+        features = np.asarray(features)
+        _, n_shades, n_textures = cls.feature_sizes()
+        return (features[..., 0] * n_shades + features[..., 1]) * n_textures + features[..., 2]
+
+    @classmethod
+    def decode_shapes(cls, ids: np.ndarray) -> np.ndarray:
+        '''Map shape IDs to an integer array of shape (..., 3) of feature indices.'''
+        ids = np.asarray(ids)
+        _, n_shades, n_textures = cls.feature_sizes()
+        return np.stack([
+            ids // (n_shades * n_textures),
+            (ids // n_textures) % n_shades,
+            ids % n_textures,
+        ], axis=-1)
+
+    @classmethod
+    def encode_states(cls, features: np.ndarray) -> np.ndarray:
+        '''Map feature indices to state IDs.
+
+        State IDs are mixed-radix numbers whose digits are the shape IDs of
+        slots 1, 2 and 3, so they follow the order of the state space.
+
+        Args:
+            features: Integer array of shape (..., 3, 3) indexed by slot, then
+                feature (sides, shade, texture)
+
+        Returns:
+            np.ndarray: Integer array of shape (...) with state IDs
+        '''
+        return cls.encode_slots(cls.encode_shapes(features))
+
+    @classmethod
+    def decode_states(cls, ids: np.ndarray) -> np.ndarray:
+        '''Map state IDs to an integer array of shape (..., 3, 3) of feature indices.'''
+        return cls.decode_shapes(cls.decode_slots(ids))
+
+    @classmethod
+    def encode_slots(cls, shape_ids: np.ndarray) -> np.ndarray:
+        '''Map an array of shape (..., 3) of per-slot shape IDs to state IDs.'''
+        shape_ids = np.asarray(shape_ids)
+        n_shapes = cls.num_shapes()
+        return (shape_ids[..., 0] * n_shapes + shape_ids[..., 1]) * n_shapes + shape_ids[..., 2]
+
+    @classmethod
+    def decode_slots(cls, ids: np.ndarray) -> np.ndarray:
+        '''Map state IDs to an array of shape (..., 3) of per-slot shape IDs.'''
+        ids = np.asarray(ids)
+        n_shapes = cls.num_shapes()
+        return np.stack([ids // (n_shapes * n_shapes), (ids // n_shapes) % n_shapes, ids % n_shapes], axis=-1)
+
+    @classmethod
+    def permute_slots(cls, ids: np.ndarray, perm: Sequence[int]) -> np.ndarray:
+        '''Return the IDs of the states whose slot k holds slot perm[k] of `ids`.'''
+        return cls.encode_slots(cls.decode_slots(ids)[..., list(perm)])
+
+    @classmethod
+    def canonical_states(cls, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''Map states to the representative of their orbit under slot permutations.
+
+        The representative is the smallest state ID in the orbit.
+
+        Args:
+            ids: State IDs
+
+        Returns:
+            tuple: (representatives, perm_indices), such that
+            permute_slots(representatives[i], SLOT_PERMUTATIONS[perm_indices[i]])
+            equals ids[i]
+        '''
+        ids = np.asarray(ids)
+        images = np.stack([cls.permute_slots(ids, perm) for perm in cls.SLOT_PERMUTATIONS])
+        best = images.argmin(axis=0)
+        # Undo the permutation that reached the representative
+        inverses = np.array([
+            cls.SLOT_PERMUTATIONS.index(tuple(np.argsort(perm)))
+            for perm in cls.SLOT_PERMUTATIONS
+        ])
+        return images.min(axis=0), inverses[best]
+
+    def shape_id(self, shape: Shape) -> int:
+        '''Return the ID of a single shape.'''
+        return int(self.encode_shapes([
+            self.SHAPE_LIST.index(shape.sides),
+            self.SHADE_LIST.index(shape.shade),
+            self.TEXTURE_LIST.index(shape.texture),
+        ]))
+
+    def state_id(self, s: State) -> int:
+        '''Return the ID of a single state, i.e. its index in the state space.'''
+        return int(self.encode_slots([self.shape_id(s.shape1), self.shape_id(s.shape2), self.shape_id(s.shape3)]))
+
+    def states_from_ids(self, ids: Sequence[int]) -> list[State]:
+        '''Convert state IDs back to State objects.'''
+        return [self.state_space[i] for i in np.asarray(ids).ravel()]
+
+    def transition_params(self) -> tuple:
+        '''Return the parameters that determine the transition dynamics.'''
+        return (
+            self.SHAPE_TRANSITION_PROB,
+            self.TEXTURE_TRANSITION_PROB,
+            self.SHADE_CYCLE_PROB,
+        )
+
+    def shape_pair_kernel(self) -> np.ndarray:
+        '''Return the distribution over the recipient's new shape.
+
+        An action only changes the recipient, and how it changes depends only
+        on the (actor shape, recipient shape) pair:
+        - sides become the actor's with SHAPE_TRANSITION_PROB, otherwise one
+          of the other sides uniformly
+        - texture advances one step (plain -> stripes -> dots -> plain)
+        - shade moves one step towards the actor's shade if they differ. If
+          they match, it stays with 1 - SHADE_CYCLE_PROB; otherwise 'low' and
+          'high' swap, and 'medium' goes to 'low' or 'high' with equal chance.
+
+        The kernel is cached per set of transition parameters, so it is
+        rebuilt whenever they change. Like the transition matrices, only the
+        PARAMETER_CACHE_SIZE most recently used settings are kept.
+
+        Returns:
+            np.ndarray: Array of shape (n_shapes, n_shapes, n_shapes) indexed
+            by (actor shape ID, recipient shape ID, new recipient shape ID)
+        '''
+        params = self.transition_params()
+        return self._cached(ShapeWorld._pair_kernel_cache, params,
+                            lambda: self._build_shape_pair_kernel(*params))
+
+    def _build_shape_pair_kernel(self, shape_prob: float, texture_prob: float,
+                                 shade_prob: float) -> np.ndarray:
+        n_sides, n_shades, n_textures = self.feature_sizes()
+        
+        # sides[actor sides, new sides]
+        sides = np.full((n_sides, n_sides), (1 - shape_prob) / (n_sides - 1))
+        np.fill_diagonal(sides, shape_prob)
+        
+        # texture[recipient texture, new texture]
+        texture = np.roll(np.eye(n_textures), 1, axis=1)
+        
+        # shade[actor shade, recipient shade, new shade]
+        low, medium, high = (self.SHADE_LIST.index(x) for x in ('low', 'medium', 'high'))
+        shade = np.zeros((n_shades, n_shades, n_shades))
+        for actor in range(n_shades):
+            for recipient in range(n_shades):
+                if actor == recipient:
+                    shade[actor, recipient, recipient] = 1 - shade_prob
+                    if recipient == medium:
+                        shade[actor, recipient, [low, high]] = shade_prob / 2
+                    else:
+                        opposite = high if recipient == low else low
+                        shade[actor, recipient, opposite] = shade_prob
+                else:
+                    step = 1 if actor > recipient else -1
+                    shade[actor, recipient, recipient + step] = 1.0
+        
+        # Indices: actor (sides a, shade b, texture c), recipient (d, e, f),
+        # new recipient (g, h, i)
+        kernel = np.einsum('ag,beh,fi,c,d->abcdefghi', sides, shade, texture,
+                           np.ones(n_textures), np.ones(n_sides))
+        n_shapes = self.num_shapes()
+        return kernel.reshape(n_shapes, n_shapes, n_shapes)
+
+    def _replace_slot(self, ids: np.ndarray, slot: int, shape_ids: np.ndarray) -> np.ndarray:
+        '''Return the state IDs with the shape in (1-based) `slot` replaced.'''
+        weight = self.num_shapes() ** (3 - slot)
+        current = (np.asarray(ids) // weight) % self.num_shapes()
+        return np.asarray(ids) + (np.asarray(shape_ids) - current) * weight
+
+    def _cached(self, cache: OrderedDict, params: tuple, build):
+        '''Return the cached value for this class and `params`.
+
+        On a miss the value is built with `build()`, and the least recently
+        used entries beyond PARAMETER_CACHE_SIZE are dropped.
+        '''
+        key = (type(self), params)
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = build()
+        cache[key] = value
+        while len(cache) > self.PARAMETER_CACHE_SIZE:
+            cache.popitem(last=False)
+        return value
+
+    def transition_pattern(self) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        '''Return the sparsity pattern of the transition matrices.
+
+        The pattern covers every transition that is possible for some
+        transition parameters, so it is built once per class. For each
+        action it holds CSR (indptr, indices) arrays and, for every stored
+        entry, its position in the flattened shape-pair kernel. Filling the
+        pattern for new parameters is then a single gather.
+
+        Returns:
+            list: One (indptr, indices, kernel_index) tuple per action
+        '''
+        key = type(self)
+        if key not in ShapeWorld._pattern_cache:
+            # Any parameters strictly inside (0, 1) reach every possible outcome
+            support = self._build_shape_pair_kernel(0.5, 1.0, 0.5) > 0
+            n_shapes = self.num_shapes()
+            n_states = len(self.state_space)
+            shape_ids = self.decode_slots(self.state_ids)
+            pattern = []
+            for a in self.action_space:
+                actor, recipient = shape_ids[:, a.actor - 1], shape_ids[:, a.recipient - 1]
+                rows, new_shape_ids = np.nonzero(support[actor, recipient])
+                cols = self._replace_slot(rows, a.recipient, new_shape_ids)
+                kernel_index = (actor[rows] * n_shapes + recipient[rows]) * n_shapes + new_shape_ids
+                # Store index + 1 so that no entry is an explicit zero
+                positions = sparse.csr_matrix(
+                    (kernel_index + 1, (rows, cols)), shape=(n_states, n_states)
+                )
+                pattern.append((positions.indptr, positions.indices, positions.data - 1))
+            ShapeWorld._pattern_cache[key] = pattern
+        return ShapeWorld._pattern_cache[key]
+
+    def transition_matrices(self) -> Sequence[sparse.csr_matrix]:
+        '''Return one sparse (n_states x n_states) transition matrix per action.
+
+        The dynamics do not depend on GOAL, so the kernel is built once per
+        set of transition parameters and shared by every goal. Each matrix
+        fills the shared `transition_pattern` with shape-pair kernel values.
+        Only the PARAMETER_CACHE_SIZE most recently used settings are kept.
+        '''
+        return self._cached(ShapeWorld._transition_cache, self.transition_params(), lambda: tuple(
+            self._build_transition_matrix(a) for a in self.action_space
+        ))
+
+    def predecessor_index(self) -> sparse.csr_matrix:
+        '''Return the reverse transition structure, cached like the kernel.
+
+        Row t holds, for each state that some action can move to t, the
+        largest probability of doing so. Like the kernel, it does not depend on GOAL and is shared by every goal.
+        '''
+        return self._cached(ShapeWorld._predecessor_cache, self.transition_params(),
+                            super().predecessor_index)
+
+    def _build_transition_matrix(self, a: Action) -> sparse.csr_matrix:
+        indptr, indices, kernel_index = self.transition_pattern()[self.action_space.index(a)]
+        n_states = len(self.state_space)
+        matrix = sparse.csr_matrix(
+            (self.shape_pair_kernel().ravel()[kernel_index], indices, indptr),
+            shape=(n_states, n_states)
+        )
+        # Transitions ruled out by boundary parameters (e.g. SHADE_CYCLE_PROB = 0)
+        matrix.eliminate_zeros()
+        return matrix
+
+    def reward_matrix(self) -> np.ndarray:
+        '''Return the expected immediate reward of each (action, state) pair.
+
+        Every action costs STEP_COST, and GOAL_REWARD is added in proportion
+        to the probability of landing in the goal.
+
+        Returns:
+            np.ndarray: Array of shape (n_actions, n_states)
+        '''
+        goal_idx = self.state_id(self.GOAL)
+        rewards = np.full((len(self.action_space), len(self.state_space)), float(self.STEP_COST))
+        for a_idx, P in enumerate(self.transition_matrices()):
+            rewards[a_idx] += self.GOAL_REWARD * P[:, goal_idx].toarray().ravel()
+        return rewards
+
     # helper functions
     def _is_goal(self, ns: State):
         return self.GOAL == ns
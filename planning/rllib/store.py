@@ -0,0 +1,111 @@
+import json
+import os
+from typing import Sequence
+import numpy as np
+
+class ValueStore:
+    """A goal x state value matrix stored on disk and opened as a memmap.
+
+    A store is a directory holding:
+    - `values.npy`: float matrix with one row per goal ID and one column per
+      state ID, readable with `np.load(..., mmap_mode='r')`
+    - `completed.npy`: one bool per goal, set once its row has been written
+    - `header.json`: metadata describing how the values were computed
+      (discount rate, transition parameters, threshold, ...)
+
+    Rows are independent, so several processes can open the same store in
+    'r+' mode and write their own goals in place.
+    """
+    VALUES_FILE = 'values.npy'
+    COMPLETED_FILE = 'completed.npy'
+    HEADER_FILE = 'header.json'
+
+    def __init__(self, path: str, mode: str = 'r'):
+        """Open an existing store.
+
+        Args:
+            path: Store directory
+            mode: 'r' to read, 'r+' to also write rows
+        """
+        if mode not in ('r', 'r+'):
+            raise ValueError("mode must be 'r' or 'r+'")
+        if not os.path.exists(os.path.join(path, self.HEADER_FILE)):
+            raise FileNotFoundError(f"No value store found at {path}")
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, self.HEADER_FILE)) as f:
+            self.metadata = json.load(f)
+        self.values = np.load(os.path.join(path, self.VALUES_FILE), mmap_mode=mode)
+        self.completed = np.load(os.path.join(path, self.COMPLETED_FILE), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path: str, n_goals: int, n_states: int,
+               metadata: dict, dtype: str = 'float64') -> 'ValueStore':
+        """Create an empty store and open it for writing.
+
+        Args:
+            path: Store directory; must not already hold a store
+            n_goals: Number of rows
+            n_states: Number of columns
+            metadata: JSON-serializable description of the computation
+            dtype: 'float32' or 'float64'
+        """
+        if os.path.exists(os.path.join(path, cls.HEADER_FILE)):
+            raise FileExistsError(f"A value store already exists at {path}")
+        os.makedirs(path, exist_ok=True)
+        values = np.lib.format.open_memmap(
+            os.path.join(path, cls.VALUES_FILE), mode='w+', dtype=dtype, shape=(n_goals, n_states)
+        )
+        completed = np.lib.format.open_memmap(
+            os.path.join(path, cls.COMPLETED_FILE), mode='w+', dtype=bool, shape=(n_goals,)
+        )
+        values.flush()
+        completed.flush()
+        del values, completed
+        # The header is written last, so its presence marks a usable store
+        with open(os.path.join(path, cls.HEADER_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2, sort_keys=True)
+        return cls(path, mode='r+')
+
+    @classmethod
+    def open_or_create(cls, path: str, n_goals: int, n_states: int,
+                       metadata: dict, dtype: str = 'float64') -> 'ValueStore':
+        """Open a store for writing, creating it if needed.
+
+        Raises:
+            ValueError: If an existing store was computed with different
+                metadata or has a different shape or dtype, so that stale
+                results are never mixed with new ones
+        """
+        if not os.path.exists(os.path.join(path, cls.HEADER_FILE)):
+            return cls.create(path, n_goals, n_states, metadata, dtype)
+        store = cls(path, mode='r+')
+        if store.metadata != json.loads(json.dumps(metadata)):
+            raise ValueError(
+                f"Value store at {path} was computed with {store.metadata}, not {metadata}"
+            )
+        if store.values.shape != (n_goals, n_states):
+            raise ValueError(f"Value store at {path} has shape {store.values.shape}")
+        if store.values.dtype != np.dtype(dtype):
+            raise ValueError(f"Value store at {path} has dtype {store.values.dtype}, not {dtype}")
+        return store
+
+    def write(self, goals: Sequence[int], values: np.ndarray) -> None:
+        """Write the value functions of `goals` and mark them completed."""
+        if self.mode != 'r+':
+            raise IOError("Value store is open read-only")
+        goals = np.asarray(goals, dtype=int)
+        self.values[goals] = values
+        self.values.flush()
+        # Only flag goals once their values are on disk
+        self.completed[goals] = True
+        self.completed.flush()
+
+    def pending(self, goals: Sequence[int]) -> np.ndarray:
+        """Return the goals whose values have not been written yet."""
+        goals = np.asarray(goals, dtype=int)
+        return goals[~self.completed[goals]]
+
+    def value_function(self, goal: int, state_space: Sequence) -> dict:
+        """Return one goal's values as a dict keyed by state."""
+        return dict(zip(state_space, self.values[goal].tolist()))
@@ -0,0 +1,162 @@
+from itertools import product
+from typing import Sequence
+import multiprocessing as mp
+import numpy as np
+from tqdm import tqdm
+from .shapeworld import ShapeWorld
+from .batch import BatchValueIteration
+from .store import ValueStore
+
+class ParameterSweep:
+    """Solve the same goals over a grid of world parameters.
+
+    The grid is the product of SHAPE_TRANSITION_PROB, SHADE_CYCLE_PROB and
+    discount rate values. Every setting shares the transition matrices'
+    sparsity pattern (see `ShapeWorld.transition_pattern`), so building a
+    setting's kernel only refills the probabilities. Each setting is
+    warm-started from the nearest setting already solved, measured in
+    parameters scaled by the grid's range.
+
+    Results go to one `ValueStore` with a row per (setting, goal) pair,
+    setting-major; its metadata records the grid and goals, so a sweep over
+    the same grid resumes where it stopped.
+    """
+    PARAMETERS = ('shape_transition_prob', 'shade_cycle_prob', 'discount_rate')
+
+    def __init__(self, goals: Sequence[int],
+                 shape_transition_probs: Sequence[float] = (ShapeWorld.SHAPE_TRANSITION_PROB,),
+                 shade_cycle_probs: Sequence[float] = (ShapeWorld.SHADE_CYCLE_PROB,),
+                 discount_rates: Sequence[float] = (0.95,),
+                 threshold: float = 1e-6,
+                 max_iterations: int = 10000,
+                 chunk_size: int = 32):
+        """Set up the grid.
+
+        Args:
+            goals: Indices of the goal states to solve in every setting
+            shape_transition_probs: Values of SHAPE_TRANSITION_PROB
+            shade_cycle_probs: Values of SHADE_CYCLE_PROB
+            discount_rates: Discount rates
+            threshold: Convergence threshold on the max value change
+            max_iterations: Maximum number of sweeps per goal
+            chunk_size: Number of goals iterated together
+        """
+        self.goals = [int(g) for g in goals]
+        self.grid = np.array(list(product(shape_transition_probs, shade_cycle_probs, discount_rates)), dtype=float)
+        if not len(self.goals) or not len(self.grid):
+            raise ValueError("goals and every parameter list must be non-empty")
+        if not ((self.grid[:, 2] > 0) & (self.grid[:, 2] < 1)).all():
+            raise ValueError("discount rates must be in (0, 1)")
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.chunk_size = chunk_size
+
+        spans = self.grid.max(axis=0) - self.grid.min(axis=0)
+        self._scaled_grid = self.grid / np.where(spans > 0, spans, 1.0)
+        self.n_states = ShapeWorld.num_shapes() ** 3
+
+    def make_world(self, setting: int) -> ShapeWorld:
+        """Return a ShapeWorld with the parameters of one grid setting."""
+        shape_prob, shade_prob, discount_rate = self.grid[setting]
+        # The goal is irrelevant: BatchValueIteration takes goals per solve
+        env = ShapeWorld(ShapeWorld.build_spaces()[1][0], float(discount_rate))
+        env.SHAPE_TRANSITION_PROB = float(shape_prob)
+        env.SHADE_CYCLE_PROB = float(shade_prob)
+        return env
+
+    def metadata(self) -> dict:
+        """Describe the sweep, so a store is only reused for the same sweep."""
+        return {
+            'parameters': list(self.PARAMETERS),
+            'grid': self.grid.tolist(),
+            'goals': self.goals,
+            'threshold': self.threshold,
+            'max_iterations': self.max_iterations,
+            'texture_transition_prob': ShapeWorld.TEXTURE_TRANSITION_PROB,
+        }
+
+    def rows(self, setting: int) -> np.ndarray:
+        """Return the store rows holding the goals of one setting."""
+        return setting * len(self.goals) + np.arange(len(self.goals))
+
+    def open_store(self, path: str, dtype: str = 'float64') -> ValueStore:
+        """Open or create the sweep's value store."""
+        return ValueStore.open_or_create(
+            path, n_goals=len(self.grid) * len(self.goals), n_states=self.n_states,
+            metadata=self.metadata(), dtype=dtype
+        )
+
+    def nearest_solved(self, setting: int, store: ValueStore) -> int:
+        """Return the completed setting nearest to `setting`, or None."""
+        completed = store.completed.reshape(len(self.grid), len(self.goals)).all(axis=1)
+        completed[setting] = False
+        if not completed.any():
+            return None
+        candidates = np.flatnonzero(completed)
+        distances = np.abs(self._scaled_grid[candidates] - self._scaled_grid[setting]).sum(axis=1)
+        return int(candidates[distances.argmin()])
+
+    def solve_setting(self, setting: int, store: ValueStore) -> int:
+        """Solve one setting, warm-started from its nearest solved neighbour.
+
+        Returns:
+            int: Total number of sweeps over the setting's goals
+        """
+        solver = BatchValueIteration(
+            mdp=self.make_world(setting),
+            chunk_size=self.chunk_size,
+            threshold=self.threshold,
+            verbose=False,
+            max_iterations=self.max_iterations
+        )
+        neighbour = self.nearest_solved(setting, store)
+        initial = None if neighbour is None else np.asarray(store.values[self.rows(neighbour)])
+        store.write(self.rows(setting), solver.solve(self.goals, initial))
+        return int(solver.iterations.sum())
+
+    def run(self, path: str, workers: int = 1, dtype: str = 'float64') -> ValueStore:
+        """Solve every setting not yet completed in the store at `path`.
+
+        Args:
+            path: Value store directory
+            workers: Number of worker processes
+            dtype: Value dtype of a new store
+
+        Returns:
+            ValueStore: The store, opened for writing
+        """
+        store = self.open_store(path, dtype)
+        pending = [
+            setting for setting in range(len(self.grid))
+            if len(store.pending(self.rows(setting)))
+        ]
+        # The transition pattern is built before forking, so workers share it
+        self.make_world(0).transition_pattern()
+
+        pbar = tqdm(total=len(pending), desc='Parameter sweep')
+        if workers <= 1:
+            for setting in pending:
+                self.solve_setting(setting, store)
+                pbar.update(1)
+        else:
+            context = mp.get_context('fork')
+            with context.Pool(workers, initializer=_init_worker, initargs=(self, store)) as pool:
+                for _ in pool.imap_unordered(_solve_setting, pending):
+                    pbar.update(1)
+        pbar.close()
+        return store
+
+    def load(self, store: ValueStore) -> np.ndarray:
+        """Return the store's values as a (n_settings, n_goals, n_states) array view."""
+        return store.values.reshape(len(self.grid), len(self.goals), self.n_states)
+
+# Per-process sweep and store, set when the pool starts
+_sweep: ParameterSweep = None
+_store: ValueStore = None
+
+def _init_worker(sweep: ParameterSweep, store: ValueStore) -> None:
+    global _sweep, _store
+    _sweep, _store = sweep, store
+
+def _solve_setting(setting: int) -> int:
+    return _sweep.solve_setting(setting, _store)
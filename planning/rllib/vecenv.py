@@ -0,0 +1,151 @@
+from typing import Callable, Sequence
+import numpy as np
+from scipy import sparse
+from .shapeworld import ShapeWorld
+
+class VecShapeWorld:
+    """Many ShapeWorld episodes stepped together on integer state IDs.
+
+    Every episode takes one action per `step`. Next states are drawn from the
+    stacked per-action transition matrices, so a step is a handful of array
+    operations whatever the number of episodes: each row's probabilities
+    are turned into a cumulative distribution offset by the row number once,
+    and a batch of uniform draws is located with a single `searchsorted`.
+
+    Each episode has its own goal, defaulting to the world's GOAL. An episode
+    terminates on reaching its goal and is truncated after `max_steps`
+    steps; either way it is reset to a random start state straight away.
+    `step` returns the true next states, for learning, while `states` holds
+    the states the episodes continue from.
+    """
+
+    def __init__(self, mdp: ShapeWorld,
+                 n_envs: int,
+                 goals: Sequence[int] = None,
+                 start_states: Sequence[int] = None,
+                 max_steps: int = None,
+                 seed: int = None):
+        """Set up the episodes.
+
+        Args:
+            mdp: ShapeWorld providing the dynamics and rewards
+            n_envs: Number of episodes stepped together
+            goals: Optional goal state ID of every episode
+            start_states: State IDs episodes start from, drawn uniformly.
+                Defaults to every state other than the episode's goal.
+            max_steps: Optional number of steps after which an episode is
+                truncated
+            seed: Seed of the NumPy random generator
+        """
+        if not isinstance(mdp, ShapeWorld):
+            raise TypeError("mdp must be an instance of ShapeWorld")
+        if n_envs <= 0:
+            raise ValueError("n_envs must be positive")
+        if max_steps is not None and max_steps <= 0:
+            raise ValueError("max_steps must be positive")
+        self.mdp = mdp
+        self.n_envs = n_envs
+        self.n_states = len(mdp.state_space)
+        self.n_actions = len(mdp.action_space)
+        self.max_steps = max_steps
+
+        if goals is None:
+            goals = np.full(n_envs, mdp.state_id(mdp.GOAL))
+        self.goals = np.asarray(goals, dtype=int)
+        if self.goals.shape != (n_envs,):
+            raise ValueError(f"goals must have shape {(n_envs,)}")
+        self.start_states = None if start_states is None else np.asarray(start_states, dtype=int)
+
+        transitions = sparse.vstack(mdp.transition_matrices(), format='csr')
+        self._indptr, self._indices = transitions.indptr, transitions.indices
+        data = transitions.data
+        rows = np.repeat(np.arange(transitions.shape[0]), np.diff(self._indptr))
+        # Row r's cumulative distribution, shifted into [r, r + 1]
+        cumulative = np.cumsum(data)
+        row_start = np.concatenate([[0.0], cumulative])[self._indptr[:-1]]
+        row_total = np.add.reduceat(data, self._indptr[:-1])
+        self._cdf = rows + (cumulative - row_start[rows]) / row_total[rows]
+
+        self.rng = np.random.default_rng(seed)
+        self.states = np.zeros(n_envs, dtype=int)
+        self.episode_returns = np.zeros(n_envs)
+        self.episode_lengths = np.zeros(n_envs, dtype=int)
+        # Returns and lengths of every episode finished since the last reset
+        self.finished_returns = []
+        self.finished_lengths = []
+        self.reset(seed)
+
+    def _sample_starts(self, episodes: np.ndarray) -> np.ndarray:
+        """Return random start states for `episodes`, avoiding their goals."""
+        if self.start_states is not None:
+            return self.rng.choice(self.start_states, size=len(episodes))
+        # Uniform over the states other than the goal
+        starts = self.rng.integers(self.n_states - 1, size=len(episodes))
+        return starts + (starts >= self.goals[episodes])
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        """Restart every episode and return the start state IDs."""
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.states = self._sample_starts(np.arange(self.n_envs))
+        self.episode_returns[:] = 0.0
+        self.episode_lengths[:] = 0
+        self.finished_returns = []
+        self.finished_lengths = []
+        return self.states.copy()
+
+    def sample_next_states(self, states: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        """Draw one next state ID per (state ID, action ID) pair."""
+        rows = np.asarray(actions) * self.n_states + np.asarray(states)
+        positions = np.searchsorted(self._cdf, rows + self.rng.random(rows.shape), side='right')
+        # Guard against draws past the last entry through rounding
+        positions = np.minimum(positions, self._indptr[rows + 1] - 1)
+        return self._indices[positions]
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Take one action ID in every episode.
+
+        Returns:
+            tuple: (next state IDs, rewards, terminated mask, truncated mask).
+            Finished episodes are already reset in `states`.
+        """
+        actions = np.asarray(actions, dtype=int)
+        if actions.shape != (self.n_envs,):
+            raise ValueError(f"actions must have shape {(self.n_envs,)}")
+        next_states = self.sample_next_states(self.states, actions)
+        terminated = next_states == self.goals
+        rewards = np.where(terminated, self.mdp.STEP_COST + self.mdp.GOAL_REWARD, float(self.mdp.STEP_COST))
+
+        self.episode_returns += rewards
+        self.episode_lengths += 1
+        truncated = ~terminated
+        if self.max_steps is None:
+            truncated[:] = False
+        else:
+            truncated &= self.episode_lengths >= self.max_steps
+
+        self.states = next_states.copy()
+        done = np.flatnonzero(terminated | truncated)
+        if done.size:
+            self.finished_returns.extend(self.episode_returns[done].tolist())
+            self.finished_lengths.extend(self.episode_lengths[done].tolist())
+            self.episode_returns[done] = 0.0
+            self.episode_lengths[done] = 0
+            self.states[done] = self._sample_starts(done)
+        return next_states, rewards, terminated, truncated
+
+    def run(self, choose_actions: Callable[[np.ndarray], np.ndarray],
+            n_steps: int) -> tuple[np.ndarray, np.ndarray]:
+        """Step every episode `n_steps` times with a fixed policy.
+
+        Args:
+            choose_actions: Maps an array of state IDs to action IDs, e.g.
+                `ArrayQLearner.greedy_actions`
+            n_steps: Number of steps per episode slot
+
+        Returns:
+            tuple: (returns, lengths) of every episode finished along the way
+        """
+        for _ in range(n_steps):
+            self.step(choose_actions(self.states))
+        return np.array(self.finished_returns), np.array(self.finished_lengths, dtype=int)
@@ -14,7 +14,10 @@ Summary:
 # Custom class imports
 from rllib.shapeworld import ShapeWorld
 from rllib.tools import isclose
-from rllib.mdp import MarkovDecisionProcess, MDPPolicy, QLearner, BellmanUpdater
+from rllib.mdp import MarkovDecisionProcess, MDPPolicy, QLearner
+from rllib.batch import BatchValueIteration
+from rllib.store import ValueStore
+from plan_all_goals import solver_metadata
 # from rllib.distributions import DiscreteDistribution
 # from rllib.gymwrap import GymWrapper
 #from rllib.simulation_result import TDLearningSimulationResult
@@ -57,38 +60,31 @@ goal_state = State(
 )
 env = ShapeWorld(goal_state, discount_rate)
 
-# Loop through every state in the ShapeWorld object env
+# Solve every state as a goal, a block of goals at a time, sharing the
+# transition kernel across all of them. Each block's value functions are
+# written as rows of a memory-mapped goal x state store instead of being
+# kept in memory, so an interrupted run resumes from the pending goals
 all_states = env.get_state_space()
-value_functions = {}  # Dictionary to store the value functions
-discount_rate = 0.5
-
-for state in tqdm(all_states):
-    # Create a new environment with the current state as the goal state
-    goal_state = state
-    env = ShapeWorld(goal_state, discount_rate)
-    
-    # Initialize the Bellman updater for the new environment
-    bellman_updater = BellmanUpdater(mdp=env, initial_value=0, threshold=1e-6, verbose=False)
-    
-    # Run value iteration
-    bellman_updater.value_iteration()
-    
-    # Retrieve the value of the goal state
-    value_function = bellman_updater.get_value(goal_state)
-    
-    # Store the value function in the dictionary
-    value_functions[state] = value_function
-
-# Save the value functions as a file
-filename = '/jukebox/niv/branson/goals/planning/value_functions.pkl'
-pd.to_pickle(value_functions, filename)
-print(f"Value functions saved as {filename}")
+threshold = 1e-6
+batch_updater = BatchValueIteration(mdp=env, chunk_size=32, initial_value=0, threshold=threshold, verbose=True)
+store_path = '/jukebox/niv/branson/goals/planning/value-function-store'
+store = ValueStore.open_or_create(
+    store_path, n_goals=len(all_states), n_states=len(all_states),
+    metadata=solver_metadata(env, threshold, batch_updater.max_iterations)
+)
+block_size = 1024
+pending_goals = store.pending(range(len(all_states)))
+for start in range(0, len(pending_goals), block_size):
+    goals = pending_goals[start:start + block_size]
+    store.write(goals, batch_updater.solve(goals))
+print(f"Value functions saved in {store_path}")
 
-# Calculate average value for each goal state
-goal_value_function = {}
-for goal_state, value_function in value_functions.items():
-    average_value = np.mean(list(value_function.values()))
-    goal_value_function[goal_state] = average_value
+# Calculate average value for each goal state, reading the store row by row
+goal_values = np.concatenate([
+    store.values[start:start + block_size].mean(axis=1)
+    for start in range(0, len(all_states), block_size)
+])
+goal_value_function = dict(zip(all_states, goal_values.tolist()))
 
 # Save the goal value function as a pickle file
 goal_value_function_filename = '/jukebox/niv/branson/goals/planning/goal_value_function.pkl'
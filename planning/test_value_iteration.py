@@ -1,6 +1,21 @@
+import os
+import random
+import tempfile
+from pathlib import Path
 import numpy as np
 from rllib.shapeworld import ShapeWorld, State, Shape, Action
-from rllib.mdp import ValueIteration
+from rllib.mdp import ValueIteration, PolicyIteration, PrioritizedSweeping, QLearner, ArrayQLearner, OptimalGoalPolicy, PCFGGoalPolicy
+from rllib.batch import BatchValueIteration
+from rllib.store import ValueStore
+from rllib.search import LAOStar
+from rllib.cache import SolutionCache
+from rllib.sweep import ParameterSweep
+from rllib.vecenv import VecShapeWorld
+from rllib.fitting import GoalChoiceModel
+from rllib.grammar import CompiledGrammar
+from rllib.programs import ProgramCompiler
+from goal_value_aggregation import (calculate_goal_value_statistics, calculate_goal_values_from_store,
+                                    summarize_values, STATISTICS)
 
 def test_simple_goal():
     """Test value iteration with a simple goal state."""
@@ -82,6 +97,637 @@ def test_value_propagation():
             print(f"State: {s}")
             print(f"Value: {value_function[s]}")
 
+def test_bellman_consistency():
+    """Test that the array backend agrees with the per-successor MDP API."""
+    
+    goal_state = State(
+        shape1=Shape(sides='square', shade='medium', texture='dots'),
+        shape2=Shape(sides='circle', shade='high', texture='plain'),
+        shape3=Shape(sides='square', shade='low', texture='stripes')
+    )
+    
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-8, verbose=False, max_iterations=1000)
+    vi.value_iteration()
+    value_function = vi.get_value_function()
+    policy = vi.get_optimal_policy()
+    
+    for s in vi.states[::997]:
+        if env.is_absorbing(s):
+            continue
+        q_values = {
+            a: sum(
+                env.transition_probability(s, a, ns) *
+                (env.reward(s, a, ns) + env.discount_rate * value_function[ns])
+                for ns in env.get_possible_next_states(s, a)
+            )
+            for a in env.get_actions(s)
+        }
+        assert np.isclose(max(q_values.values()), value_function[s], atol=1e-6)
+        assert np.isclose(q_values[policy[s]], value_function[s], atol=1e-6)
+
+def test_policy_iteration_matches_value_iteration():
+    """Test that exact and modified policy iteration agree with value iteration."""
+    
+    goal_state = State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='square', shade='medium', texture='stripes'),
+        shape3=Shape(sides='triangle', shade='high', texture='dots')
+    )
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-10, verbose=False)
+    vi.value_iteration()
+    
+    for evaluation_sweeps in [None, 10]:
+        pi = PolicyIteration(mdp=env, threshold=1e-10, verbose=False,
+                             evaluation_sweeps=evaluation_sweeps)
+        pi.policy_iteration()
+        assert pi.has_converged()
+        assert pi.iterations < vi.iterations
+        assert np.allclose(pi.values, vi.values, atol=1e-8)
+        assert pi.get_value(goal_state) == 0.0
+
+def test_gauss_seidel_matches_value_iteration():
+    """Test that in-place layered sweeps converge to the same values in fewer sweeps."""
+    
+    goal_state = State(
+        shape1=Shape(sides='square', shade='high', texture='dots'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='triangle', shade='medium', texture='stripes')
+    )
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-10, verbose=False)
+    vi.value_iteration()
+    gs = ValueIteration(mdp=env, threshold=1e-10, verbose=False, gauss_seidel=True)
+    gs.value_iteration()
+    
+    layers = gs.distance_layers()
+    assert list(layers[0]) == [env.state_id(goal_state)]
+    assert sum(len(layer) for layer in layers) == len(env.state_space)
+    assert gs.has_converged()
+    assert gs.iterations < vi.iterations
+    assert np.allclose(gs.values, vi.values, atol=1e-8)
+
+def test_accelerated_value_iteration():
+    """Test that SOR and Anderson acceleration converge to the plain fixed point."""
+    
+    goal_state = State(
+        shape1=Shape(sides='square', shade='high', texture='dots'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='triangle', shade='medium', texture='stripes')
+    )
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-10, verbose=False, gauss_seidel=True)
+    vi.value_iteration()
+    
+    for acceleration in ['sor', 'anderson']:
+        accelerated = ValueIteration(mdp=env, threshold=1e-10, verbose=False,
+                                     gauss_seidel=True, acceleration=acceleration)
+        accelerated.value_iteration()
+        assert accelerated.has_converged()
+        assert accelerated.accepted_steps > 0
+        assert np.allclose(accelerated.values, vi.values, atol=1e-8)
+        # Solving again does no more sweeps, and the budget is never exceeded
+        iterations = accelerated.iterations
+        accelerated.value_iteration()
+        assert accelerated.iterations == iterations
+        for max_iterations in range(1, 8):
+            capped = ValueIteration(mdp=env, verbose=False, gauss_seidel=True,
+                                    acceleration=acceleration, max_iterations=max_iterations)
+            capped.value_iteration()
+            assert capped.iterations <= max_iterations
+    assert accelerated.iterations < vi.iterations
+
+def test_predecessor_index():
+    """Test that row t of the predecessor index lists the states that can move to t."""
+    
+    goal_state = State(
+        shape1=Shape(sides='square', shade='high', texture='dots'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='triangle', shade='medium', texture='stripes')
+    )
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    s = env.state_id(env.state_space[5000])
+    predecessors = env.predecessor_index()
+    for P in env.transition_matrices():
+        for t in P[s].indices:
+            assert s in predecessors[t].indices
+            assert predecessors[t, s] >= P[s, t]
+
+def test_prioritized_sweeping():
+    """Test that warm-started prioritized sweeping matches value iteration with fewer backups."""
+    
+    space = ShapeWorld.build_spaces()[1]
+    env = ShapeWorld(space[5000], discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-10, verbose=False)
+    vi.value_iteration()
+    neighbour = ValueIteration(mdp=ShapeWorld(space[5001], discount_rate=0.9), threshold=1e-10, verbose=False)
+    neighbour.value_iteration()
+    
+    ps = PrioritizedSweeping(mdp=env, threshold=1e-10, verbose=False)
+    ps.values = neighbour.values.copy()
+    ps.prioritized_sweeping()
+    assert ps.has_converged()
+    assert ps.backups < vi.iterations * len(env.state_space)
+    assert np.allclose(ps.values, vi.values, atol=1e-8)
+    
+    # The round budget is respected, and the unfinished solve reports it
+    capped = PrioritizedSweeping(mdp=env, threshold=1e-10, verbose=False, max_iterations=5)
+    capped.prioritized_sweeping()
+    assert capped.iterations == 5 and not capped.has_converged()
+
+def test_lao_star_matches_value_iteration():
+    """Test that single-query search returns the start value from value iteration."""
+    
+    goal_state = State(
+        shape1=Shape(sides='square', shade='high', texture='dots'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='triangle', shade='medium', texture='stripes')
+    )
+    env = ShapeWorld(goal_state, discount_rate=0.9)
+    vi = ValueIteration(mdp=env, threshold=1e-10, verbose=False)
+    vi.value_iteration()
+    
+    planner = LAOStar(mdp=env, threshold=1e-10)
+    # The heuristic must never underestimate a value
+    assert (planner.heuristic(env.state_id(goal_state)) >= vi.values - 1e-9).all()
+    
+    start = env.state_space[12345]
+    value, policy = planner.solve(start, goal_state)
+    assert np.isclose(value, vi.get_value(start), atol=1e-8)
+    assert start in policy
+    assert planner.solve(goal_state, goal_state)[0] == 0.0
+
+def test_state_encoding():
+    """Test that integer state IDs follow the state space order and round-trip."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='square', shade='medium', texture='stripes'),
+        shape3=Shape(sides='triangle', shade='high', texture='dots')
+    ), discount_rate=0.9)
+    
+    assert len(env.state_space) == 19683
+    assert (env.encode_states(env.decode_states(env.state_ids)) == env.state_ids).all()
+    for i in [0, 26, 27, 728, 729, 12345, 19682]:
+        s = env.state_space[i]
+        assert env.state_id(s) == i
+        assert env.states_from_ids([i]) == [s]
+        for slot, shape in enumerate([s.shape1, s.shape2, s.shape3]):
+            sides, shade, texture = env.state_features[i, slot]
+            assert shape == Shape(sides=env.SHAPE_LIST[sides], shade=env.SHADE_LIST[shade],
+                                  texture=env.TEXTURE_LIST[texture])
+            assert env.shape_space[env.shape_id(shape)] == shape
+
+def test_shape_pair_kernel():
+    """Test that the shape-pair kernel drives transitions and tracks parameters."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    ), discount_rate=0.9)
+    kernel = env.shape_pair_kernel()
+    assert kernel.shape == (27, 27, 27)
+    assert np.allclose(kernel.sum(axis=-1), 1.0)
+    
+    s = env.state_space[5000]
+    for a in env.action_space:
+        next_states = env.get_possible_next_states(s, a)
+        assert np.isclose(sum(env.transition_probability(s, a, ns) for ns in next_states), 1.0)
+    
+    # Changing a transition parameter must not reuse the cached kernel
+    env.SHADE_CYCLE_PROB = 0.3
+    medium = env.shape_id(Shape(sides='circle', shade='medium', texture='plain'))
+    to_low = env.shape_id(Shape(sides='circle', shade='low', texture='stripes'))
+    assert np.isclose(env.shape_pair_kernel()[medium, medium, to_low], 0.9 * 0.3 / 2)
+    assert env.transition_matrices() is not ShapeWorld(env.GOAL, 0.9).transition_matrices()
+
+def test_batch_matches_single_goal():
+    """Test that batched value iteration reproduces per-goal value iteration."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    ), discount_rate=0.9)
+    goals = [0, 4321, 9841, 19682]
+    
+    batch = BatchValueIteration(mdp=env, chunk_size=3, threshold=1e-6, verbose=False)
+    values = batch.solve(goals)
+    assert batch.has_converged().all()
+    
+    for i, goal_idx in enumerate(goals):
+        goal_env = ShapeWorld(env.state_space[goal_idx], discount_rate=0.9)
+        vi = ValueIteration(mdp=goal_env, threshold=1e-6, verbose=False)
+        vi.value_iteration()
+        assert batch.iterations[i] == vi.iterations
+        assert np.allclose(values[i], vi.values)
+
+def test_batch_symmetry():
+    """Test that solving one goal per slot-permutation orbit loses nothing."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    ), discount_rate=0.9)
+    goal = env.state_id(State(
+        shape1=Shape(sides='circle', shade='low', texture='dots'),
+        shape2=Shape(sides='square', shade='high', texture='plain'),
+        shape3=Shape(sides='triangle', shade='medium', texture='stripes')
+    ))
+    goals = [env.permute_slots(goal, perm) for perm in env.SLOT_PERMUTATIONS] + [0, 13]
+    
+    representatives, _ = env.canonical_states(goals)
+    assert len(set(representatives[:6])) == 1
+    
+    symmetric = BatchValueIteration(mdp=env, verbose=False, use_symmetry=True).solve(goals)
+    direct = BatchValueIteration(mdp=env, verbose=False, use_symmetry=False).solve(goals)
+    assert np.allclose(symmetric, direct)
+
+def test_batch_multiple_discounts():
+    """Test that solving several discounts in one pass matches solving each alone."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    ), discount_rate=0.9)
+    goals = [0, 1, 27, 12345]
+    discount_rates = [0.5, 0.9]
+    
+    batch = BatchValueIteration(mdp=env, verbose=False)
+    values = batch.solve_discounts(goals, discount_rates)
+    assert values.shape == (2, len(goals), len(env.state_space))
+    assert batch.has_converged().shape == (2, len(goals))
+    # Smaller discounts converge in fewer sweeps
+    assert (batch.iterations[0] < batch.iterations[1]).all()
+    for k, discount_rate in enumerate(discount_rates):
+        single = BatchValueIteration(mdp=ShapeWorld(env.GOAL, discount_rate), verbose=False)
+        assert np.allclose(values[k], single.solve(goals))
+
+def test_batch_warm_start():
+    """Test that warm-started goals converge to the cold-start values."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    ), discount_rate=0.9)
+    # Goals 0, 1 and 2 differ only in the last slot's texture
+    goals = [2, 1, 0, 40]
+    
+    warm = BatchValueIteration(mdp=env, chunk_size=1, verbose=False, use_symmetry=False, warm_start=True)
+    cold = BatchValueIteration(mdp=env, chunk_size=1, verbose=False, use_symmetry=False)
+    assert np.allclose(warm.solve(goals), cold.solve(goals), atol=1e-4)
+    assert warm.has_converged().all()
+
+def test_value_store(tmp_path):
+    """Test that value store rows persist and stale metadata or dtypes are rejected."""
+    
+    path = str(tmp_path / 'store')
+    metadata = {'discount_rate': 0.9, 'threshold': 1e-6}
+    store = ValueStore.open_or_create(path, n_goals=5, n_states=4, metadata=metadata)
+    store.write([1, 3], np.array([[1., 2., 3., 4.], [5., 6., 7., 8.]]))
+    assert list(store.pending(range(5))) == [0, 2, 4]
+    
+    reader = ValueStore(path)
+    assert reader.metadata == metadata
+    assert np.array_equal(reader.values[3], [5., 6., 7., 8.])
+    assert list(np.flatnonzero(reader.completed)) == [1, 3]
+    
+    try:
+        ValueStore.open_or_create(path, n_goals=5, n_states=4, metadata={'discount_rate': 0.5})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Opening a store with different metadata should fail")
+    
+    try:
+        ValueStore.open_or_create(path, n_goals=5, n_states=4, metadata=metadata, dtype='float32')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Opening a store with a different dtype should fail")
+
+def test_goal_value_statistics(tmp_path):
+    """Test that chunked store statistics match a direct computation."""
+
+    path = str(tmp_path / 'store')
+    _, state_space = ShapeWorld.build_spaces()
+    store = ValueStore.open_or_create(path, n_goals=len(state_space), n_states=50, metadata={})
+    goals = [0, 7, 5000, 19682]
+    values = np.random.default_rng(0).normal(size=(len(goals), 50))
+    store.write(goals, values)
+
+    statistics = calculate_goal_value_statistics(path, chunk_size=3)
+    assert set(statistics) == {state_space[g] for g in goals}
+    expected = summarize_values(values)
+    for goal, row in zip(goals, expected):
+        assert np.allclose([statistics[state_space[goal]][k] for k in STATISTICS], row)
+    assert np.isclose(statistics[state_space[7]]['mean'], values[1].mean())
+    assert np.isclose(statistics[state_space[7]]['q50'], np.median(values[1]))
+    means = calculate_goal_values_from_store(store, chunk_size=2)
+    assert np.isclose(means[state_space[5000]], values[2].mean())
+
+def test_solution_cache(tmp_path):
+    """Test that cached solutions are keyed on every world parameter and evicted by size."""
+    
+    env = ShapeWorld(State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='square', shade='medium', texture='stripes'),
+        shape3=Shape(sides='triangle', shade='high', texture='dots')
+    ), discount_rate=0.9)
+    cache = SolutionCache(str(tmp_path / 'cache'), max_entries=1)
+    key = cache.key(env, threshold=1e-6)
+    assert cache.get(key) is None
+    cache.put(key, np.arange(4.0))
+    
+    # A fresh cache over the same directory finds the solution on disk
+    assert np.array_equal(SolutionCache(str(tmp_path / 'cache')).get(key), np.arange(4.0))
+    
+    env.SHADE_CYCLE_PROB = 0.2
+    assert cache.key(env, threshold=1e-6) != key
+    assert cache.key(ShapeWorld(env.GOAL, discount_rate=0.95), threshold=1e-6) != key
+    assert cache.key(ShapeWorld(env.GOAL, discount_rate=0.9), threshold=1e-8) != key
+    
+    small = SolutionCache(str(tmp_path / 'small'), max_bytes=200)
+    small.put('a', np.zeros(8))
+    small.put('b', np.zeros(8))
+    assert small.get('a') is None
+    assert small.get('b') is not None
+    
+    # A hit served from memory still counts as a use when evicting
+    recent = SolutionCache(str(tmp_path / 'recent'), max_bytes=400)
+    recent.put('a', np.zeros(8))
+    recent.put('b', np.zeros(8))
+    os.utime(recent._path('a'), (1, 1))
+    os.utime(recent._path('b'), (2, 2))
+    assert recent.get('a') is not None
+    recent.put('c', np.zeros(8))
+    assert recent.get('a') is not None
+    assert recent.get('b') is None
+    
+    # Files removed by another process mid-eviction are skipped
+    os.symlink(tmp_path / 'missing.npy', recent._path('gone'))
+    recent.put('d', np.zeros(8))
+    assert recent.get('d') is not None
+
+def test_parameter_sweep(tmp_path):
+    """Test that a warm-started sweep matches solving each setting from scratch."""
+    
+    goals = [0, 5000, 12345]
+    sweep = ParameterSweep(goals, shape_transition_probs=[0.8, 0.9], discount_rates=[0.9])
+    store = sweep.run(str(tmp_path / 'sweep'))
+    assert store.completed.all()
+    
+    values = sweep.load(store)
+    for setting in range(len(sweep.grid)):
+        env = sweep.make_world(setting)
+        assert env.transition_params()[0] == sweep.grid[setting, 0]
+        cold = BatchValueIteration(mdp=env, threshold=1e-6, verbose=False).solve(goals)
+        assert np.allclose(values[setting], cold, atol=1e-4)
+
+def test_kernel_cache_is_bounded():
+    """Test that visiting many transition parameters keeps only the most recent kernels."""
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][0], discount_rate=0.9)
+    for shade_prob in np.linspace(0.05, 0.5, ShapeWorld.PARAMETER_CACHE_SIZE + 3):
+        env.SHADE_CYCLE_PROB = shade_prob
+        matrices = env.transition_matrices()
+        assert env.transition_matrices() is matrices
+    for cache in (ShapeWorld._transition_cache, ShapeWorld._pair_kernel_cache):
+        assert len(cache) <= ShapeWorld.PARAMETER_CACHE_SIZE
+        assert next(reversed(cache)) == (ShapeWorld, env.transition_params())
+    for P in matrices:
+        assert np.allclose(P.sum(axis=1), 1.0)
+
+def test_array_q_learner_matches_q_learner():
+    """Test that the array-backed learner makes the same updates and choices as QLearner."""
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][0], discount_rate=0.9)
+    args = dict(discount_rate=0.9, learning_rate=0.5, initial_value=0.0,
+                epsilon=0.0, action_space=env.action_space)
+    learner = QLearner(**args)
+    array_learner = ArrayQLearner(**args, state_space=env.state_space)
+    
+    rng = random.Random(0)
+    s = env.state_space[0]
+    for _ in range(200):
+        a = rng.choice(env.action_space)
+        ns = env.next_state_sample(s, a, rng)
+        r = env.reward(s, a, ns)
+        learner.update(s, a, r, ns)
+        array_learner.update(s, a, r, ns)
+        assert np.isclose(array_learner.state_value(s), learner.state_value(s))
+        assert array_learner.sample_action(s) == learner.sample_action(s)
+        s = ns
+    
+    ids = np.array([env.state_id(s)])
+    assert array_learner.greedy_actions(ids)[0] == env.action_space.index(learner.sample_action(s)[0])
+    actions, nll = array_learner.sample_actions(np.arange(10), np.random.default_rng(0))
+    assert actions.shape == (10,) and not nll.any()
+
+def test_vectorized_environment():
+    """Test that the vectorized environment samples the kernel and resets finished episodes."""
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][5000], discount_rate=0.9)
+    vec_env = VecShapeWorld(env, n_envs=4, max_steps=3, seed=0)
+    
+    next_states = vec_env.sample_next_states(np.full(100000, 123), np.full(100000, 2))
+    frequencies = np.bincount(next_states, minlength=len(env.state_space)) / len(next_states)
+    assert np.allclose(frequencies, env.transition_matrices()[2][123].toarray().ravel(), atol=0.01)
+    
+    goal = env.state_id(env.GOAL)
+    for _ in range(3):
+        _, rewards, terminated, truncated = vec_env.step(np.zeros(4, dtype=int))
+        assert np.all(rewards == env.STEP_COST + env.GOAL_REWARD * terminated)
+    assert truncated.all() and not vec_env.episode_lengths.any()
+    assert not np.any(vec_env.states == goal)
+    assert vec_env.finished_lengths == [3, 3, 3, 3]
+
+def test_optimal_goal_policy_likelihoods():
+    """Test the cached log-softmax and alias sampling of OptimalGoalPolicy."""
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][0], discount_rate=0.9)
+    values = np.random.default_rng(0).normal(size=len(env.state_space))
+    policy = OptimalGoalPolicy(env, dict(zip(env.state_space, values)), temperature=0.5)
+    
+    probabilities = np.exp(values - values.max()) / np.exp(values - values.max()).sum()
+    s = env.state_space[123]
+    assert np.isclose(policy.calc_log_lik(s), -np.log(probabilities[123]))
+    assert np.isclose(policy.calc_log_likelihood_all()[s], -np.log(probabilities[123]))
+    
+    # Sampling uses the policy's own temperature
+    probabilities = np.exp(2 * (values - values.max()))
+    probabilities /= probabilities.sum()
+    accept, alias = policy.alias_table()
+    table = accept / len(values)
+    np.add.at(table, alias, (1 - accept) / len(values))
+    assert np.allclose(table, probabilities)
+    goal, nll = policy.sample_action(random.Random(0))
+    assert np.isclose(nll, -np.log(probabilities[env.state_id(goal)]))
+    indices, nlls = policy.sample_actions(10, np.random.default_rng(0))
+    assert np.allclose(nlls, -np.log(probabilities[indices]))
+
+def test_goal_choice_fitting():
+    """Test that fitted temperatures match the per-choice likelihoods of OptimalGoalPolicy."""
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][0], discount_rate=0.9)
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=len(env.state_space))
+    policy = OptimalGoalPolicy(env, dict(zip(env.state_space, values)), temperature=0.5)
+    model = GoalChoiceModel.from_policy(policy)
+    
+    choices = np.concatenate([policy.sample_actions(200, rng)[0], rng.integers(len(values), size=5)])
+    participants = np.repeat([0, 1], [200, 5])
+    nll = model.neg_log_likelihood(choices, [0.5, 1.0], participants)
+    states = [policy.states[c] for c in choices[:200]]
+    assert np.isclose(nll[0, 0], policy.calc_log_likelihood_batch(states, temperature=0.5).sum())
+    
+    fit = model.fit(choices, participants)
+    assert abs(fit.temperature[0] - 0.5) < 0.1
+    grid = np.linspace(0.3, 0.7, 401)
+    assert np.isclose(fit.neg_log_likelihood[0], model.neg_log_likelihood(choices[:200], grid).min(), atol=1e-3)
+    assert fit.neg_log_likelihood[0] <= model.neg_log_likelihood(choices[:200], grid).min()
+    assert fit.converged.all()
+    
+    # Always choosing a best goal, or never beating the average, is clamped
+    ranked = np.argsort(values)
+    clamped = model.fit(np.concatenate([ranked[-3:], ranked[:3]]), np.repeat([0, 1], 3))
+    assert clamped.greedy.tolist() == [False, False] and clamped.uniform.tolist() == [False, True]
+    assert clamped.temperature[1] == np.inf
+    greedy = model.fit([ranked[-1]] * 3)
+    assert greedy.greedy[0] and greedy.temperature[0] == 0.0
+    
+    # Participant IDs without choices are left unfitted
+    gap = GoalChoiceModel(-np.arange(1, 101.)).fit([0, 1, 2, 3], [0, 0, 2, 2])
+    assert np.isnan(gap.temperature[1]) and np.isnan(gap.neg_log_likelihood[1])
+    assert not (gap.greedy[1] or gap.uniform[1] or gap.converged[1])
+    assert gap.converged[[0, 2]].all() and np.isfinite(gap.temperature[[0, 2]]).all()
+    
+    stopped = model.fit(choices, participants, max_iterations=1)
+    assert not stopped.converged[0] and stopped.iterations == 1
+
+def test_compiled_grammar():
+    """Test that compiled grammar samples follow the string-rewriting depth cap."""
+    
+    grammar = CompiledGrammar([['S', ['aS', 'b']]], cap=2)
+    draws = grammar.sample(20000, np.random.default_rng(0))
+    # S -> aS needs k + 1 expansions for a^k b, and at most cap + 1 are allowed
+    assert {d for d in draws if d is not None} == {
+        ('a' * k + 'b', -(k + 1) * np.log(2)) for k in range(3)
+    }
+    assert abs(np.mean([d is None for d in draws]) - 1 / 8) < 0.01
+    # Start forms may contain literal text the productions do not
+    program, log_prob = grammar.sample(1, np.random.default_rng(0), start='z(S)', log_prob=-1.0, depth=3)[0]
+    assert program == 'z(b)' and np.isclose(log_prob, -1.0 - np.log(2))
+    
+    env = ShapeWorld(ShapeWorld.build_spaces()[1][0], discount_rate=0.9)
+    policy = PCFGGoalPolicy(env, [['S', ['and(S,S)', 'A']], ['A', ['x', 'y']]], cap=100)
+    program, log_prob = policy.generate_tree(logging=False, rng=np.random.default_rng(1))
+    assert np.isclose(log_prob, -np.log(2) * (2 * program.count('and') + 1 + program.count('x') + program.count('y')))
+    # A seeded policy samples the same programs every time
+    seeded = [PCFGGoalPolicy(env, [['S', ['and(S,S)', 'A']], ['A', ['x', 'y']]], cap=100, seed=3) for _ in range(2)]
+    assert seeded[0].generate_trees(20) == seeded[1].generate_trees(20)
+
+def recursive_generate_tree(productions, cap, tree_str, log_prob, depth, rng):
+    """The string-rewriting `generate_tree` of pcfg/Grammar.py that CompiledGrammar replaced."""
+    non_terminals = [nt for nt in productions if nt in tree_str]
+    nt = rng.choice(non_terminals)
+    leaf = rng.choice(productions[nt])
+    index = tree_str.find(nt)
+    tree_str = tree_str[:index] + leaf + tree_str[index + 1:]
+    log_prob += np.log(1 / len(productions[nt]))
+    depth += 1
+    if any(nt in tree_str for nt in productions) and depth <= cap:
+        return recursive_generate_tree(productions, cap, tree_str, log_prob, depth, rng)
+    elif any(nt in tree_str for nt in productions):
+        return None
+    return tree_str, log_prob
+
+def test_compiled_grammar_matches_recursive_sampler():
+    """Test that cap rejections match the recursive sampler, also when starting below the root."""
+    
+    productions = {'S': ['aS', 'b']}
+    grammar = CompiledGrammar([['S', productions['S']]], cap=3)
+    rng, old_rng = np.random.default_rng(0), random.Random(0)
+    n = 20000
+    for depth in (0, 2, 3, 5):
+        # A derivation with k expansions has probability 2^-k; it is rejected
+        # when depth + k exceeds cap + 1, unless it finishes in one expansion
+        expected = sum(0.5 ** k for k in range(2, 64) if depth + k > grammar.cap + 1)
+        new = grammar.sample(n, rng, log_prob=-1.0, depth=depth)
+        old = [recursive_generate_tree(productions, grammar.cap, 'S', -1.0, depth, old_rng) for _ in range(n)]
+        for draws in (new, old):
+            assert abs(np.mean([d is None for d in draws]) - expected) < 0.015
+        accepted = {(program, round(lp, 9)) for program, lp in filter(None, new)}
+        assert accepted == {(program, round(lp, 9)) for program, lp in filter(None, old)}
+    assert np.isclose(grammar.cap_mass(), 0.5 ** 4)
+
+def test_program_enumeration():
+    """Test exact program probabilities, cap mass and ambiguous derivations."""
+    
+    distribution = CompiledGrammar([['S', ['aS', 'b']]], cap=2).enumerate_programs()
+    assert [(p, prob) for p, prob, _ in distribution] == [('b', 0.5), ('ab', 0.25), ('aab', 0.125)]
+    assert np.isclose(distribution.cap_mass, 0.125) and distribution.pruned_mass < 1e-12
+    
+    # 'x' comes from S -> A -> x (probability 1/2) and S -> B -> x (1/4)
+    distribution = CompiledGrammar([['S', ['A', 'B']], ['A', ['x']], ['B', ['x', 'y']]]).enumerate_programs()
+    program, prob, lp = distribution.programs[0]
+    assert program == 'x' and np.isclose(prob, 0.75)
+    assert np.isclose(lp, (0.5 * np.log(0.5) + 0.25 * np.log(0.25)) / 0.75)
+    
+    # A smaller expansion budget moves mass from the programs to cap_mass
+    grammar = CompiledGrammar([['S', ['and(S,S)', 'A']], ['A', ['x', 'y', 'z']]], cap=100)
+    distribution = grammar.enumerate_programs(min_prob=1e-12, max_expansions=8)
+    assert max(len(p) for p, _, _ in distribution) == len('and(x,and(x,x))')
+    found = sum(prob for _, prob, _ in distribution)
+    assert np.isclose(found + distribution.cap_mass, 1.0) and distribution.pruned_mass < 1e-12
+    
+    # Streaming yields every derivation, best first, without fixing min_prob
+    stream = list(grammar.iter_programs(max_expansions=8))
+    assert [lp for _, lp in stream] == sorted((lp for _, lp in stream), reverse=True)
+    assert np.isclose(sum(np.exp(lp) for _, lp in stream), found)
+    assert {p for p, _ in stream} == {p for p, _, _ in distribution}
+    first = next(grammar.iter_programs(start='not(S)'))
+    assert first[0] in ('not(x)', 'not(y)', 'not(z)') and np.isclose(first[1], np.log(1 / 6))
+
+def test_program_compiler():
+    """Test program masks against counts and a direct check of single states."""
+    
+    compiler = ProgramCompiler()
+    n_shapes = ShapeWorld.num_shapes()
+    assert compiler.count(compiler.compile('same(everything,true)')) == n_shapes
+    assert compiler.count(compiler.compile('unique(everything,true)')) == n_shapes * (n_shapes - 1) * (n_shapes - 2)
+    assert compiler.count(compiler.compile('same(a, square)')) == len(compiler.features) // 3
+    
+    # A single object is compared with the other two
+    n_states, n_square = len(compiler.features), n_shapes // 3
+    assert compiler.count(compiler.compile('unique(a,square)')) == n_square * (n_shapes - n_square) ** 2
+    assert compiler.count(compiler.compile('unique(a,shape)')) == n_shapes * (n_shapes - n_square) ** 2
+    masks = compiler.compile_many(['same(a,shape)', 'unique(a,shape)'])
+    assert compiler.unpack(masks[0] ^ masks[1]).all()
+    assert compiler.count(compiler.compile('unique(one,true)')) == n_states - n_shapes
+    assert compiler.count(compiler.compile('same(one,color)')) == n_states - n_shapes * (n_shapes - 9) * (n_shapes - 18)
+    
+    program = 'and(unique(two,light),same(bc,shape))'
+    masks = compiler.compile_many([program, 'unique(two,light)', 'same(bc,shape)'])
+    assert np.array_equal(masks[0], masks[1] & masks[2])
+    assert 'unique(two,light)' in compiler._cache
+    
+    low = ShapeWorld.SHADE_LIST.index('low')
+    features = compiler.features
+    n_low = (features[:, :, 1] == low).sum(axis=1)
+    expected = ((n_low == 1) | (n_low == 2)) & (features[:, 1, 0] == features[:, 2, 0])
+    assert np.array_equal(compiler.unpack(masks[0]), expected)
+
+def run_with_temporary_directory(test):
+    """Run a test that takes pytest's tmp_path fixture outside of pytest."""
+    with tempfile.TemporaryDirectory() as directory:
+        test(Path(directory))
+
 def main():
     print("Testing Value Iteration Implementation")
     print("\n1. Testing with simple goal state...")
@@ -90,6 +736,56 @@ def main():
     print("\n2. Testing value propagation...")
     test_value_propagation()
     
+    print("\n3. Testing Bellman consistency...")
+    test_bellman_consistency()
+    
+    print("\n4. Testing policy iteration...")
+    test_policy_iteration_matches_value_iteration()
+    
+    print("\n5. Testing Gauss-Seidel sweeps...")
+    test_gauss_seidel_matches_value_iteration()
+    test_accelerated_value_iteration()
+    test_predecessor_index()
+    test_prioritized_sweeping()
+    test_lao_star_matches_value_iteration()
+    
+    print("\n6. Testing state encoding...")
+    test_state_encoding()
+    
+    print("\n7. Testing shape-pair kernel...")
+    test_shape_pair_kernel()
+    
+    print("\n8. Testing batched value iteration...")
+    test_batch_matches_single_goal()
+    
+    print("\n9. Testing goal symmetry reduction...")
+    test_batch_symmetry()
+    
+    print("\n10. Testing multiple discount rates and warm starts...")
+    test_batch_multiple_discounts()
+    test_batch_warm_start()
+    
+    print("\n11. Testing value storage and caching...")
+    run_with_temporary_directory(test_value_store)
+    run_with_temporary_directory(test_goal_value_statistics)
+    run_with_temporary_directory(test_solution_cache)
+    run_with_temporary_directory(test_parameter_sweep)
+    test_kernel_cache_is_bounded()
+    
+    print("\n12. Testing Q-learning and vectorized environments...")
+    test_array_q_learner_matches_q_learner()
+    test_vectorized_environment()
+    
+    print("\n13. Testing goal choice likelihoods...")
+    test_optimal_goal_policy_likelihoods()
+    test_goal_choice_fitting()
+    
+    print("\n14. Testing goal grammar and programs...")
+    test_compiled_grammar()
+    test_compiled_grammar_matches_recursive_sampler()
+    test_program_enumeration()
+    test_program_compiler()
+    
     print("\nAll tests completed!")
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ Summary:
 ##################################################
 
 # Core imports
+import os
 import sys
 import numpy as np
 import pandas as pd
@@ -21,18 +22,24 @@ from tqdm import tqdm
 # Custom imports
 from rllib.shapeworld import ShapeWorld, State, Shape, Action
 from rllib.mdp import ValueIteration
+from rllib.batch import BatchValueIteration
+from rllib.cache import SolutionCache
 
 ##################################################
 # VALUE ITERATION FOR A SINGLE GOAL
 ##################################################
 
-def run_value_iteration(goal_index: int, discount_rate: float = 0.95) -> tuple[dict, State]: # thinking of changing discount rate to 0.9
-def run_value_iteration(goal_index: int, discount_rate: float = 0.95) -> tuple[dict, State]:
+def run_value_iteration(goal_index: int, discount_rate: float = 0.95,
+                        acceleration: str = None,
+                        cache: SolutionCache = None) -> tuple[dict, State]:
     """Run value iteration for a specific goal state.
     
     Args:
         goal_index: Index of the goal state in state space
         discount_rate: Discount factor for future rewards
+        acceleration: None, 'sor' or 'anderson'; see ValueIteration
+        cache: Optional solution cache; a hit skips value iteration and
+            converged solutions are added to it
         
     Returns:
         tuple: (value_function, goal_state)
@@ -53,14 +60,22 @@ def run_value_iteration(goal_index: int, discount_rate: float = 0.95) -> tuple[d
         raise ValueError(f"Goal index {goal_index} is out of range. Max index is {len(state_space)-1}")
     
     env = ShapeWorld(goal_state, discount_rate)
+    threshold = 1e-6
+    
+    if cache is not None:
+        cache_key = cache.key(env, threshold)
+        values = cache.get(cache_key)
+        if values is not None:
+            return dict(zip(state_space, values.tolist())), goal_state
     
     # Run value iteration with progress tracking
     value_it = ValueIteration(
         mdp=env, 
         initial_value=0.0, 
-        threshold=1e-6, 
+        threshold=threshold, 
         verbose=False,  # Disable default printing
-        max_iterations=10000
+        max_iterations=10000,
+        acceleration=acceleration
     )
     
     pbar = tqdm(desc=f"Value Iteration (Goal {goal_index})")
@@ -86,35 +101,110 @@ def run_value_iteration(goal_index: int, discount_rate: float = 0.95) -> tuple[d
     
     if not value_it.has_converged():
         print("Warning: Value iteration did not converge to specified threshold")
+    elif cache is not None:
+        cache.put(cache_key, value_it.values)
+    if acceleration is not None:
+        print(f"{acceleration}: {value_it.iterations} sweeps, "
+              f"{value_it.accepted_steps} accelerated steps kept, {value_it.rejected_steps} rejected")
     
     return value_it.get_value_function(), goal_state
 
-def save_results(value_function: dict, goal_state: State, goal_index: int) -> None:
+##################################################
+# VALUE ITERATION FOR A RANGE OF GOALS
+##################################################
+
+def run_batch_value_iteration(goal_indices: Sequence[int], discount_rate: float = 0.95,
+                              chunk_size: int = 32) -> tuple[np.ndarray, list[State]]:
+    """Run value iteration for many goal states, sharing one transition kernel.
+    
+    Args:
+        goal_indices: Indices of the goal states in state space
+        discount_rate: Discount factor for future rewards
+        chunk_size: Number of goals iterated together
+        
+    Returns:
+        tuple: (values, state_space), where values[i] is the value function
+        of goal_indices[i] ordered like state_space
+    """
+    initial_state = State(
+        shape1=Shape(sides='circle', shade='low', texture='plain'),
+        shape2=Shape(sides='circle', shade='low', texture='plain'),
+        shape3=Shape(sides='circle', shade='low', texture='plain')
+    )
+    env = ShapeWorld(initial_state, discount_rate)
+    state_space = env.get_state_space()
+    
+    out_of_range = [i for i in goal_indices if not 0 <= i < len(state_space)]
+    if out_of_range:
+        raise ValueError(f"Goal indices {out_of_range} are out of range. Max index is {len(state_space)-1}")
+    
+    batch_it = BatchValueIteration(
+        mdp=env,
+        chunk_size=chunk_size,
+        initial_value=0.0,
+        threshold=1e-6,
+        verbose=True,
+        max_iterations=10000
+    )
+    values = batch_it.solve(goal_indices)
+    
+    if not batch_it.has_converged().all():
+        print("Warning: Value iteration did not converge to specified threshold for some goals")
+    
+    return values, state_space
+
+def result_filename(goal_index: int, directory: str = './value-iteration-results') -> str:
+    """Return the path of the saved value function for a goal."""
+    return os.path.join(directory, f'value_function_goal_{goal_index}.pkl')
+
+def save_results(value_function: dict, goal_state: State, goal_index: int,
+                 directory: str = './value-iteration-results', verbose: bool = True) -> None:
     """Save value function and goal state to file.
     
+    The file is written under a temporary name and then renamed, so an
+    interrupted run never leaves a truncated result behind.
+    
     Args:
         value_function: Computed value function
         goal_state: Goal state used
         goal_index: Index of goal state for filename
+        directory: Directory to save the file in
+        verbose: Whether to print the saved filename
     """
-    filename = f'./value-iteration-results/value_function_goal_{goal_index}.pkl'
-    pd.to_pickle((value_function, goal_state), filename)
-    print(f"Value function saved as {filename}")
+    filename = result_filename(goal_index, directory)
+    pd.to_pickle((value_function, goal_state), filename + '.tmp', compression=None)
+    os.replace(filename + '.tmp', filename)
+    if verbose:
+        print(f"Value function saved as {filename}")
 
 def main():
     """Main execution function."""
-    if len(sys.argv) != 2:
-        print("Usage: python value_iteration.py <goal_index>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python value_iteration.py <goal_index> [<stop_index>]")
+        print("Set VALUE_ITERATION_CACHE to a directory to reuse cached solutions")
         sys.exit(1)
         
     try:
         goal_index = int(sys.argv[1])
+        stop_index = int(sys.argv[2]) if len(sys.argv) == 3 else None
     except ValueError:
-        print("Error: goal_index must be an integer")
+        print("Error: goal_index and stop_index must be integers")
         sys.exit(1)
         
-    value_function, goal_state = run_value_iteration(goal_index)
-    save_results(value_function, goal_state, goal_index)
+    if stop_index is None:
+        # The all-goals array job solves each goal once, so caching is opt-in
+        cache_directory = os.environ.get('VALUE_ITERATION_CACHE')
+        cache = SolutionCache(cache_directory) if cache_directory else None
+        value_function, goal_state = run_value_iteration(goal_index, cache=cache)
+        save_results(value_function, goal_state, goal_index)
+        return
+    
+    # Solve the half-open range [goal_index, stop_index) in one process
+    goal_indices = list(range(goal_index, stop_index))
+    values, state_space = run_batch_value_iteration(goal_indices)
+    for i, goal_idx in enumerate(goal_indices):
+        value_function = dict(zip(state_space, values[i].tolist()))
+        save_results(value_function, state_space[goal_idx], goal_idx)
 
 if __name__ == "__main__":
     main()